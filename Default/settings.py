@@ -10,8 +10,35 @@ from Default.mappings import *
 specification_url = 'http://hl7.org/fhir/2018May/'
 #specification_url = 'http://build.fhir.org'
 
+# How to download the specification: number of concurrent downloads, retries per file and, optionally, SHA-256 hex
+# digests to verify downloaded files against, keyed by file name (e.g. `{'examples-json.zip': '<sha256>'}`)
+download_workers = 4
+download_retries = 3
+specification_checksums = {}
+
+# Whether to extract downloaded ZIP archives; the spec is otherwise read straight out of them. Turn on if you need the
+# example files on disk, e.g. to point `FHIR_UNITTEST_DATADIR` at when running generated unit tests.
+expand_spec_archives = False
+
+# Whether to keep a snapshot of the parsed spec in the download directory, which is re-used as long as the downloaded
+# files, settings and mappings do not change. Supply "--reparse" to `generate.py` to ignore it.
+cache_parsed_spec = True
+
 # In which directory to find the templates. See below for settings that start with `tpl_`: these are the template names.
 tpl_base = 'Sample'
+tpl_bytecode_cache = 'downloads/jinja'      # directory to cache compiled template bytecode in; can be `None`
+tpl_precompiled_target = None               # if set, the directory to compile templates to Python modules to and load them from
+
+# Whether to keep a manifest of rendered files in the download directory, to skip rendering outputs whose template,
+# spec and settings did not change and to only write files whose content differs
+incremental_rendering = True
+
+# How many worker processes to use for work that can be parallelized, like processing profiles and rendering; override
+# with "-j N"
+parallel_workers = 1
+
+# Where to write the report of time and memory spent per phase, profile and template when running "generate.py --profile"
+profile_report_target = 'profile.json'
 
 # Whether and where to put the generated class models
 write_resources = True
@@ -20,14 +47,20 @@ tpl_resource_target = '../models'                     # target directory to writ
 tpl_resource_target_ptrn = '{}.py'                    # target class file name pattern, with one placeholder (`{}`) for the class name
 tpl_codesystems_source = 'template-codesystems.py'    # the template to use as source when writing enums for CodeSystems; can be `None`
 tpl_codesystems_target_name = 'codesystems.py'        # the filename to use for the generated code systems and value sets (in `tpl_resource_target`)
+resource_slots = False                                # whether generated classes declare `__slots__` instead of giving every instance a `__dict__`
+resource_from_json = False                            # whether generated classes get code reading their own properties from JSON, faster than the generic `update_with_json()`
+resource_to_json = False                              # whether generated classes get code writing their own properties to JSON, faster than the generic `as_json()`
 
-# Whether and where to put the factory methods and the dependency graph
+# Whether and where to put the factory methods, the dependency graph and the package `__init__`
 write_factory = True
 tpl_factory_source = 'template-elementfactory.py'       # the template to use for factory generation
 tpl_factory_target = '../models/fhirelementfactory.py'  # where to write the generated factory to
 write_dependencies = False
 tpl_dependencies_source = 'template-dependencies.json'  # template used to render the JSON dependency graph
 tpl_dependencies_target = './dependencies.json'         # write dependency JSON to project root
+write_package = False
+tpl_package_source = 'template-package.py'              # template for the package `__init__`, which imports modules and classes when first accessed
+tpl_package_target = '../models/__init__.py'            # where to write the package `__init__` to
 
 # Whether and where to write unit tests
 write_unittests = True
@@ -63,4 +96,6 @@ manual_profiles = [
     ('Sample/fhirabstractresource.py', 'fhirabstractresource', ['FHIRAbstractResource']),
     ('Sample/fhirreference.py', 'fhirreference', ['FHIRReference']),
     ('Sample/fhirdate.py', 'fhirdate', ['date', 'dateTime', 'instant', 'time']),
+    ('Sample/fhirndjson.py', 'fhirndjson', []),
+    ('Sample/fhirbundlereader.py', 'fhirbundlereader', []),
 ]
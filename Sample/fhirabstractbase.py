@@ -4,7 +4,9 @@
 #  Base class for all FHIR elements.
 
 import sys
+import copy
 import logging
+import importlib
 
 
 class FHIRValidationError(Exception):
@@ -38,12 +40,35 @@ class FHIRValidationError(Exception):
         applied. """
         path = '{}.{}'.format(path_prefix, self.path) if self.path is not None else path_prefix
         return self.__class__(self.errors, path)
+    
+    def __reduce__(self):
+        """ Pickles `errors` and `path` rather than the composed message,
+        so instances survive being sent back from worker processes. """
+        return (self.__class__, (self.errors, self.path))
 
 
 class FHIRAbstractBase(object):
     """ Abstract base class for all FHIR elements.
+    
+    Subclasses may declare their properties in `__slots__` instead of
+    assigning None to each of them on init; slots that have not been
+    assigned then read as None, see `__getattr__()`.
+    
+    Instances created with `with_json_lazily()` keep their JSON dictionary
+    and only instantiate their properties when one of them is first
+    accessed, see `_materialize()`.
     """
     
+    __slots__ = ('_owner', '_lazy')
+    
+    _str_types = (str, unicode) if sys.version_info < (3, 0) else (str,)
+    """ What string values from JSON may be instances of, used by generated
+    `_json_readers`. """
+    
+    trust_json = False
+    """ Process-wide default: if True, the initializer treats JSON as already
+    validated, like `with_trusted_json()` does. """
+    
     def __init__(self, jsondict=None, strict=True):
         """ Initializer. If strict is true, raises on errors, otherwise uses
         `logging.warning()`.
@@ -56,8 +81,14 @@ class FHIRAbstractBase(object):
         self._owner = None
         """ Points to the parent resource, if there is one. """
         
+        self._lazy = None
+        """ The JSON dictionary and strictness of instances created with
+        `with_json_lazily()`, until their properties are instantiated. """
+        
         if jsondict is not None:
-            if strict:
+            if self.trust_json:
+                self._update_with_trusted_json(jsondict)
+            elif strict:
                 self.update_with_json(jsondict)
             else:
                 try:
@@ -66,6 +97,19 @@ class FHIRAbstractBase(object):
                     for err in e.errors:
                         logging.warning(err)
     
+    def __getattr__(self, name):
+        """ Only called if `name` is not found the usual way, which for slots
+        means they have not been assigned. Those default to None. For
+        properties of lazily created instances, instantiates the properties
+        first.
+        """
+        if '_lazy' != name and self._lazy is not None and name in _property_table(type(self)).names:
+            self._materialize()
+            return getattr(self, name)
+        if name in _slot_names(type(self)):
+            return None
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+    
     
     # MARK: Instantiation from JSON
     
@@ -110,6 +154,129 @@ class FHIRAbstractBase(object):
                 .format(type(self), type(jsondict)))
         return cls(jsondict)
     
+    @classmethod
+    def with_trusted_json(cls, jsonobj):
+        """ Like `with_json()`, but for JSON that is known to be valid, for
+        example because it has been produced by `as_json()`: assigns values
+        to properties without validating them. Wrong types are assigned as
+        they are, missing non-optional properties go unnoticed and unknown
+        keys are ignored.
+        
+        :param jsonobj: A dict or list of dicts to instantiate from
+        :returns: An instance or a list of instances created from JSON data
+        """
+        return cls.with_trusted_json_and_owner(jsonobj, None)
+    
+    @classmethod
+    def with_trusted_json_and_owner(cls, jsonobj, owner):
+        """ Like `with_json_and_owner()`, for JSON that is known to be valid.
+        """
+        if isinstance(jsonobj, list):
+            return [cls._with_trusted_json_dict(jsondict, owner) for jsondict in jsonobj]
+        return cls._with_trusted_json_dict(jsonobj, owner)
+    
+    @classmethod
+    def _with_trusted_json_dict(cls, jsondict, owner):
+        instance = cls._instance_for_json(jsondict)
+        instance._owner = owner
+        instance._update_with_trusted_json(jsondict)
+        return instance
+    
+    @classmethod
+    def _instance_for_json(cls, jsondict):
+        """ An empty instance, to be updated with the given JSON dictionary.
+        """
+        return cls()
+    
+    def _update_with_trusted_json(self, jsondict):
+        """ Like `update_with_json()`, but does not validate: looks up the
+        property of every key and assigns the value, instantiating elements
+        with `with_trusted_json_and_owner()`.
+        """
+        by_jsname = _property_table(type(self)).by_jsname
+        for key, value in jsondict.items():
+            prop = by_jsname.get(key)
+            if prop is not None and value is not None:
+                if prop.with_trusted_json_and_owner is not None:
+                    value = prop.with_trusted_json_and_owner(value, self)
+                setattr(self, prop.name, value)
+    
+    @classmethod
+    def with_json_lazily(cls, jsonobj, strict=True):
+        """ Like `with_json()`, but the instances keep the JSON dictionary and
+        only instantiate their properties, shallowly, when one of them is
+        first accessed. Validation is deferred until then, so that is when
+        a FHIRValidationError is raised (strict, on every access until the
+        JSON validates) or logged. `as_json()` of an instance whose
+        properties have never been accessed or assigned returns a copy of
+        the original JSON dictionary, if not strict.
+        
+        :raises: TypeError on anything but dict or list of dicts
+        :param jsonobj: A dict or list of dicts to instantiate from
+        :param bool strict: Whether to raise or log validation errors
+        :returns: An instance or a list of instances
+        """
+        if isinstance(jsonobj, dict):
+            return cls._with_json_dict_lazily(jsonobj, strict)
+        
+        if isinstance(jsonobj, list):
+            return [cls._with_json_dict_lazily(jsondict, strict) for jsondict in jsonobj]
+        
+        raise TypeError("`with_json()` on {} only takes dict or list of dict, but you provided {}"
+            .format(cls, type(jsonobj)))
+    
+    @classmethod
+    def _with_json_dict_lazily(cls, jsondict, strict):
+        """ Internal method to create a lazy instance for a JSON dictionary,
+        without calling the initializer.
+        """
+        if not isinstance(jsondict, dict):
+            raise TypeError("Can only use `_with_json_dict()` on {} with a dictionary, got {}"
+                .format(cls, type(jsondict)))
+        instance = cls.__new__(cls)
+        instance._owner = None
+        instance._lazy = (jsondict, strict)
+        return instance
+    
+    def _materialize(self):
+        """ Instantiates the properties of a lazily created instance from its
+        JSON dictionary, themselves lazily, keeping values that have been
+        assigned in the meantime.
+        
+        :raises: FHIRValidationError on validation errors, if strict; the
+            instance then stays lazy, so the next access raises again
+        """
+        jsondict, strict = self._lazy
+        properties = _property_table(type(self)).properties
+        assigned = self._assigned_properties()
+        for prop in properties:
+            setattr(self, prop.name, None)
+        try:
+            self.update_with_json(jsondict)
+        except FHIRValidationError as e:
+            if strict:
+                for prop in properties:
+                    delattr(self, prop.name)
+                for name, value in assigned.items():
+                    setattr(self, name, value)
+                raise
+            for err in e.errors:
+                logging.warning(err)
+        self._lazy = None
+        for name, value in assigned.items():
+            setattr(self, name, value)
+    
+    def _assigned_properties(self):
+        """ The properties that have a value, bypassing `__getattr__()`.
+        """
+        assigned = {}
+        for prop in _property_table(type(self)).properties:
+            try:
+                assigned[prop.name] = object.__getattribute__(self, prop.name)
+            except AttributeError:
+                pass
+        return assigned
+    
     @classmethod
     def with_json_and_owner(cls, jsonobj, owner):
         """ Instantiates by forwarding to `with_json()`, then remembers the
@@ -122,7 +289,10 @@ class FHIRAbstractBase(object):
         :param FHIRElement owner: The owning parent
         :returns: An instance or a list of instances created from JSON data
         """
-        instance = cls.with_json(jsonobj)
+        if owner is not None and owner._lazy is not None:
+            instance = cls.with_json_lazily(jsonobj, owner._lazy[1])
+        else:
+            instance = cls.with_json(jsonobj)
         if isinstance(instance, list):
             for inst in instance:
                 inst._owner = owner
@@ -137,6 +307,9 @@ class FHIRAbstractBase(object):
     def elementProperties(self):
         """ Returns a list of tuples, one tuple for each property that should
         be serialized, as: ("name", "json_name", type, is_list, "of_many", not_optional)
+        
+        Called once per class to build the `FHIRPropertyTable` that
+        (de)serialization works from.
         """
         return []
     
@@ -154,22 +327,25 @@ class FHIRAbstractBase(object):
             raise FHIRValidationError("Non-dict type {} fed to `update_with_json` on {}"
                 .format(type(jsondict), type(self)))
         
+        table = _property_table(type(self))
+        if table.readers is not None:
+            return self._update_with_json_items(jsondict, table)
+        
         # loop all registered properties and instantiate
         errs = []
-        valid = set(['resourceType'])
         found = set()
         nonoptionals = set()
-        for name, jsname, typ, is_list, of_many, not_optional in self.elementProperties():
-            valid.add(jsname)
-            if of_many is not None:
-                valid.add(of_many)
+        for prop in table.properties:
+            name = prop.name
+            jsname = prop.jsname
+            of_many = prop.of_many
             
             # bring the value in shape
             err = None
             value = jsondict.get(jsname)
-            if value is not None and hasattr(typ, 'with_json_and_owner'):
+            if value is not None and prop.with_json_and_owner is not None:
                 try:
-                    value = typ.with_json_and_owner(value, self)
+                    value = prop.with_json_and_owner(value, self)
                 except Exception as e:
                     value = None
                     err = e
@@ -177,17 +353,17 @@ class FHIRAbstractBase(object):
             # got a value, test if it is of required type and assign
             if value is not None:
                 testval = value
-                if is_list:
+                if prop.is_list:
                     if not isinstance(value, list):
                         err = TypeError("Wrong type {} for list property \"{}\" on {}, expecting a list of {}"
-                            .format(type(value), name, type(self), typ))
+                            .format(type(value), name, type(self), prop.type))
                         testval = None
                     else:
                         testval = value[0] if value and len(value) > 0 else None
                 
-                if testval is not None and not self._matches_type(testval, typ):
+                if testval is not None and not isinstance(testval, prop.matching_types):
                     err = TypeError("Wrong type {} for property \"{}\" on {}, expecting {}"
-                        .format(type(testval), name, type(self), typ))
+                        .format(type(testval), name, type(self), prop.type))
                 else:
                     setattr(self, name, value)
                 
@@ -196,16 +372,9 @@ class FHIRAbstractBase(object):
                     found.add(of_many)
             
             # not optional and missing, report (we clean `of_many` later on)
-            elif not_optional:
+            elif prop.not_optional:
                 nonoptionals.add(of_many or jsname)
             
-            # TODO: look at `_name` only if this is a primitive!
-            _jsname = '_'+jsname
-            _value = jsondict.get(_jsname)
-            if _value is not None:
-                valid.add(_jsname)
-                found.add(_jsname)
-            
             # report errors
             if err is not None:
                 errs.append(err.prefixed(name) if isinstance(err, FHIRValidationError) else FHIRValidationError([err], name))
@@ -216,18 +385,57 @@ class FHIRAbstractBase(object):
                 errs.append(KeyError("Non-optional property \"{}\" on {} is missing"
                     .format(miss, self)))
         
-        # were there superfluous dictionary keys?
-        if len(set(jsondict.keys()) - valid) > 0:
-            for supflu in set(jsondict.keys()) - valid:
+        # were there superfluous dictionary keys? (`_name` entries of properties are valid unless null)
+        superfluous = [key for key in set(jsondict.keys()) - table.valid_keys \
+            if key not in table.extension_keys or jsondict[key] is None]
+        if len(superfluous) > 0:
+            for supflu in superfluous:
                 errs.append(AttributeError("Superfluous entry \"{}\" in data for {}"
                     .format(supflu, self)))
         
         if len(errs) > 0:
             raise FHIRValidationError(errs)
     
+    def _update_with_json_items(self, jsondict, table):
+        """ Like `update_with_json()`, but only looks at the keys present in
+        the JSON dictionary, handing their values to the `_json_readers`
+        generated for the properties. Reports the same errors, in the same
+        order.
+        """
+        errs = []
+        found = set()
+        superfluous = []
+        readers = table.readers
+        for key, value in jsondict.items():
+            reader = readers.get(key)
+            if reader is None:
+                if key not in table.valid_keys and (key not in table.extension_keys or value is None):
+                    superfluous.append(key)
+            elif value is not None:
+                err = reader(self, value, found)
+                if err is not None:
+                    errs.append((table.positions[key], key, err))
+        
+        # report errors in the order of properties, like `update_with_json()`
+        if len(errs) > 0:
+            errs = [err.prefixed(table.by_jsname[key].name) if isinstance(err, FHIRValidationError) \
+                else FHIRValidationError([err], table.by_jsname[key].name) for pos, key, err in sorted(errs, key=lambda e: e[0])]
+        
+        for miss in table.nonoptionals - found:
+            errs.append(KeyError("Non-optional property \"{}\" on {} is missing"
+                .format(miss, self)))
+        
+        for supflu in superfluous:
+            errs.append(AttributeError("Superfluous entry \"{}\" in data for {}"
+                .format(supflu, self)))
+        
+        if len(errs) > 0:
+            raise FHIRValidationError(errs)
+    
     def as_json(self):
-        """ Serializes to JSON by inspecting `elementProperties()` and creating
-        a JSON dictionary of all registered properties. Checks:
+        """ Serializes to JSON by inspecting the properties in
+        `elementProperties()` and creating a JSON dictionary of all registered
+        properties. Checks:
         
         - whether required properties are not None (and lists not empty)
         - whether not-None properties are of the correct type
@@ -236,55 +444,64 @@ class FHIRAbstractBase(object):
             required properties are empty
         :returns: A validated dict object that can be JSON serialized
         """
+        if self._lazy is not None:
+            jsondict, strict = self._lazy
+            if not strict and len(self._assigned_properties()) == 0:
+                return copy.deepcopy(jsondict)
+            self._materialize()
+        
         js = {}
         errs = []
         
         # JSONify all registered properties
         found = set()
-        nonoptionals = set()
-        for name, jsname, typ, is_list, of_many, not_optional in self.elementProperties():
-            if not_optional:
-                nonoptionals.add(of_many or jsname)
-            
-            err = None
-            value = getattr(self, name)
-            if value is None:
-                continue
-            
-            if is_list:
-                if not isinstance(value, list):
-                   err = TypeError("Expecting property \"{}\" on {} to be list, but is {}"
-                       .format(name, type(self), type(value)))
-                elif len(value) > 0:
-                    if not self._matches_type(value[0], typ):
+        table = _property_table(type(self))
+        if table.has_json_writers:
+            self._write_json(js, errs, found)
+        else:
+            for prop in table.properties:
+                name = prop.name
+                jsname = prop.jsname
+                err = None
+                value = getattr(self, name)
+                if value is None:
+                    continue
+                
+                if prop.is_list:
+                    if not isinstance(value, list):
+                       err = TypeError("Expecting property \"{}\" on {} to be list, but is {}"
+                           .format(name, type(self), type(value)))
+                    elif len(value) > 0:
+                        if value[0] is not None and not isinstance(value[0], prop.matching_types):
+                            err = TypeError("Expecting property \"{}\" on {} to be {}, but is {}"
+                                .format(name, type(self), prop.type, type(value[0])))
+                        else:
+                            lst = []
+                            for v in value:
+                                try:
+                                    lst.append(v.as_json() if hasattr(v, 'as_json') else v)
+                                except FHIRValidationError as e:
+                                    err = e.prefixed(str(len(lst))).prefixed(name)
+                            found.add(prop.of_many or jsname)
+                            js[jsname] = lst
+                else:
+                    if not isinstance(value, prop.matching_types):
                         err = TypeError("Expecting property \"{}\" on {} to be {}, but is {}"
-                            .format(name, type(self), typ, type(value[0])))
+                            .format(name, type(self), prop.type, type(value)))
                     else:
-                        lst = []
-                        for v in value:
-                            try:
-                                lst.append(v.as_json() if hasattr(v, 'as_json') else v)
-                            except FHIRValidationError as e:
-                                err = e.prefixed(str(len(lst))).prefixed(name)
-                        found.add(of_many or jsname)
-                        js[jsname] = lst
-            else:
-                if not self._matches_type(value, typ):
-                    err = TypeError("Expecting property \"{}\" on {} to be {}, but is {}"
-                        .format(name, type(self), typ, type(value)))
-                else:
-                    try:
-                        found.add(of_many or jsname)
-                        js[jsname] = value.as_json() if hasattr(value, 'as_json') else value
-                    except FHIRValidationError as e:
-                        err = e.prefixed(name)
-            
-            if err is not None:
-                errs.append(err if isinstance(err, FHIRValidationError) else FHIRValidationError([err], name))
+                        try:
+                            found.add(prop.of_many or jsname)
+                            js[jsname] = value.as_json() if prop.has_as_json else value
+                        except FHIRValidationError as e:
+                            err = e.prefixed(name)
+                
+                if err is not None:
+                    errs.append(err if isinstance(err, FHIRValidationError) else FHIRValidationError([err], name))
         
         # any missing non-optionals?
-        if len(nonoptionals - found) > 0:
-            for nonop in nonoptionals - found:
+        missing = table.nonoptionals - found if table.nonoptionals else None
+        if missing:
+            for nonop in missing:
                 errs.append(KeyError("Property \"{}\" on {} is not optional, you must provide a value for it"
                     .format(nonop, self)))
         
@@ -292,6 +509,14 @@ class FHIRAbstractBase(object):
             raise FHIRValidationError(errs)
         return js
     
+    def _write_json(self, js, errs, found):
+        """ Generated in subclasses to add their own properties to the JSON
+        dictionary `js`, after calling the superclass' implementation.
+        Collects errors in `errs` and the JSON names (or choice group names)
+        of non-optional properties that have a value in `found`.
+        """
+        pass
+    
     def _matches_type(self, value, typ):
         if value is None:
             return True
@@ -324,3 +549,151 @@ class FHIRAbstractBase(object):
             owner = owner._owner
         return owner
 
+
+class FHIRLazyModule(object):
+    """ Stands in for a sibling module that a generated module refers to,
+    without importing it. On first attribute access, imports the module and
+    replaces itself with it in the referring module's namespace, so later
+    references cost nothing extra.
+    """
+    
+    __slots__ = ('_referrer', '_name')
+    
+    def __init__(self, referrer, name):
+        """ Initializer.
+        
+        :param str referrer: `__name__` of the module holding the reference
+        :param str name: The name of the sibling module
+        """
+        self._referrer = referrer
+        self._name = name
+    
+    def __getattr__(self, attr):
+        module = importlib.import_module('{}.{}'.format(self._referrer.rpartition('.')[0], self._name))
+        setattr(sys.modules[self._referrer], self._name, module)
+        return getattr(module, attr)
+
+
+_slots_by_class = {}
+
+def _slot_names(cls):
+    """ The set of all names in `__slots__` of the class and its superclasses.
+    """
+    names = _slots_by_class.get(cls)
+    if names is None:
+        names = set()
+        for klass in cls.__mro__:
+            names.update(klass.__dict__.get('__slots__', ()))
+        _slots_by_class[cls] = names = frozenset(names)
+    return names
+
+
+class FHIRProperty(object):
+    """ One property of a FHIR element, as declared in `elementProperties()`,
+    with what (de)serialization needs to know about its type worked out.
+    """
+    
+    __slots__ = ('name', 'jsname', 'type', 'is_list', 'of_many', 'not_optional',
+        'matching_types', 'with_json_and_owner', 'with_trusted_json_and_owner', 'has_as_json')
+    
+    def __init__(self, name, jsname, typ, is_list, of_many, not_optional):
+        self.name = name
+        self.jsname = jsname
+        self.type = typ
+        self.is_list = is_list
+        self.of_many = of_many
+        self.not_optional = not_optional
+        
+        self.matching_types = (typ,)
+        """ The types values must be instances of, see `_matches_type()`. """
+        if int == typ or float == typ:
+            self.matching_types = (int, float)
+        elif (sys.version_info < (3, 0)) and (str == typ or unicode == typ):
+            self.matching_types = (str, unicode)
+        
+        self.with_json_and_owner = getattr(typ, 'with_json_and_owner', None)
+        """ The method instantiating values from JSON, if not primitive. """
+        
+        self.with_trusted_json_and_owner = getattr(typ, 'with_trusted_json_and_owner', self.with_json_and_owner)
+        """ The same, for JSON known to be valid. """
+        
+        self.has_as_json = hasattr(typ, 'as_json')
+
+
+class FHIRPropertyTable(object):
+    """ All properties of a FHIR element class, superclasses' included, in
+    the order of `elementProperties()` and indexed by their JSON name.
+    
+    Built once per class and not to be modified.
+    """
+    
+    __slots__ = ('properties', 'names', 'by_jsname', 'positions', 'valid_keys', 'extension_keys', 'nonoptionals', 'readers', 'has_json_writers')
+    
+    def __init__(self, element_properties, readers=None, has_json_writers=False):
+        self.properties = tuple(FHIRProperty(*p) for p in element_properties)
+        """ Tuple of FHIRProperty, in order. """
+        
+        self.names = frozenset(p.name for p in self.properties)
+        """ The (Python) names of all properties. """
+        
+        self.by_jsname = dict((p.jsname, p) for p in self.properties)
+        """ Property by the name it has in JSON. """
+        
+        self.positions = dict((p.jsname, i) for i, p in enumerate(self.properties))
+        """ Index in `properties` by JSON name. """
+        
+        valid = set(['resourceType'])
+        for p in self.properties:
+            valid.add(p.jsname)
+            if p.of_many is not None:
+                valid.add(p.of_many)
+        self.valid_keys = frozenset(valid)
+        """ All keys allowed in JSON, besides `extension_keys`. """
+        
+        self.extension_keys = frozenset('_'+p.jsname for p in self.properties)
+        """ The "_name" keys of all properties, allowed in JSON unless their
+        value is null. """
+        
+        self.nonoptionals = frozenset(p.of_many or p.jsname for p in self.properties if p.not_optional)
+        """ JSON names (or choice group names) that must have a value. """
+        
+        self.readers = readers
+        """ Functions reading the value of a JSON entry into the property
+        with that JSON name, generated for all properties, or None. """
+        
+        self.has_json_writers = has_json_writers
+        """ Whether `_write_json()` has been generated for all properties. """
+
+
+_tables_by_class = {}
+
+def _property_table(cls):
+    """ The FHIRPropertyTable of the given FHIRAbstractBase subclass, built
+    from `elementProperties()` on first use.
+    """
+    table = _tables_by_class.get(cls)
+    if table is None:
+        declaring = _declaring_classes(cls)
+        table = FHIRPropertyTable(cls.elementProperties(cls.__new__(cls)), _json_readers(declaring),
+            len(declaring) > 0 and all('_write_json' in k.__dict__ for k in declaring))
+        _tables_by_class[cls] = table
+    return table
+
+
+def _declaring_classes(cls):
+    """ The class and those of its superclasses that declare properties,
+    superclasses first.
+    """
+    return [k for k in reversed(cls.__mro__) if 'elementProperties' in k.__dict__ and k is not FHIRAbstractBase]
+
+
+def _json_readers(declaring):
+    """ Collects the `_json_readers` generated for the given classes, None
+    unless all of them have them.
+    """
+    if len(declaring) == 0 or not all('_json_readers' in k.__dict__ for k in declaring):
+        return None
+    readers = {}
+    for klass in declaring:
+        readers.update(klass.__dict__['_json_readers'])
+    return readers
@@ -12,6 +12,8 @@ class FHIRAbstractResource(fhirabstractbase.FHIRAbstractBase):
     """
     resource_type = 'FHIRAbstractResource'
     
+    __slots__ = ('_server', '_local_id')
+    
     def __init__(self, jsondict=None, strict=True):
         self._server = None
         """ The server the instance was read from. """
@@ -38,6 +40,31 @@ class FHIRAbstractResource(fhirabstractbase.FHIRAbstractBase):
             return fhirelementfactory.FHIRElementFactory.instantiate(res_type, jsondict)
         return super(FHIRAbstractResource, cls)._with_json_dict(jsondict)
     
+    @classmethod
+    def _instance_for_json(cls, jsondict):
+        """ Overridden to return an instance of the class the factory would
+        instantiate if "resourceType" does not match the receiver's.
+        """
+        res_type = jsondict.get('resourceType')
+        if res_type and res_type != cls.resource_type:
+            return fhirelementfactory.FHIRElementFactory.class_for(res_type)()
+        return cls()
+    
+    @classmethod
+    def _with_json_dict_lazily(cls, jsondict, strict):
+        """ Overridden to use the class the factory would instantiate if
+        "resourceType" does not match the receiver's resource_type.
+        """
+        if not isinstance(jsondict, dict):
+            raise Exception("Cannot use this method with anything but a JSON dictionary, got {}"
+                .format(jsondict))
+        
+        res_type = jsondict.get('resourceType')
+        if res_type and res_type != cls.resource_type:
+            klass = fhirelementfactory.FHIRElementFactory.class_for(res_type)
+            return klass._with_json_dict_lazily(jsondict, strict)
+        return super(FHIRAbstractResource, cls)._with_json_dict_lazily(jsondict, strict)
+    
     def as_json(self):
         js = super(FHIRAbstractResource, self).as_json()
         js['resourceType'] = self.resource_type
@@ -157,5 +184,5 @@ class FHIRAbstractResource(fhirabstractbase.FHIRAbstractBase):
         return None
 
 
-from . import fhirdate
-from . import fhirelementfactory
+fhirdate = fhirabstractbase.FHIRLazyModule(__name__, "fhirdate")
+fhirelementfactory = fhirabstractbase.FHIRLazyModule(__name__, "fhirelementfactory")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Stream the entries out of a Bundle's JSON.
+
+import io
+import json
+import logging
+
+
+class FHIRBundleReader(object):
+    """ Reads a Bundle from a file-like object one entry at a time, instead
+    of decoding the whole Bundle and instantiating all of its entries.
+    
+    On init, the JSON is read up to its "entry" array and `bundle` is
+    created from what came before, lazily (see `with_json_lazily()`), so
+    `type`, `total`, `link` and the like are available before any entry
+    has been read; `bundle.entry` stays None. Top-level values following
+    the entries, which servers don't usually send, are added before the
+    Bundle's values are instantiated and validated once `entries()`
+    finishes, unless `bundle` has been used before; used before, it only
+    has (and validates) the values preceding the entries until then. Only
+    the entry currently being decoded is held in memory.
+        
+        with io.open('searchset.json', 'rb') as handle:
+            reader = FHIRBundleReader(handle)
+            print(reader.bundle.total)
+            for resource in reader.resources():
+                ...
+    """
+    
+    chunk_size = 1 << 16
+    
+    def __init__(self, handle, strict=True):
+        """ Initializer. Reads and instantiates the Bundle up to its entries.
+        
+        :raises: ValueError if the data is not a JSON Bundle
+        :raises: FHIRValidationError if the Bundle has no entries and is
+            invalid
+        :param handle: A text or binary stream, binary is decoded as UTF-8
+        :param bool strict: If True (the default), invalid data raises an
+            error, as when instantiating model classes
+        """
+        if isinstance(handle, (io.RawIOBase, io.BufferedIOBase)):
+            handle = io.TextIOWrapper(handle, encoding='utf-8')
+        self.handle = handle
+        self.strict = strict
+        self.num_entries = 0
+        self._jsondict = {}
+        self._num_leading = 0
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._started = False
+        self._decoder = json.JSONDecoder()
+        
+        self._expect('{')
+        if self._peek_is('}'):
+            self._expect('}')
+            self._has_entries = False
+        else:
+            self._has_entries = self._read_members()
+        
+        self.bundle = self._instantiate_bundle()
+        """ The `Bundle` instance, without entries. """
+        
+        if not self._has_entries:
+            self._complete_bundle()
+    
+    def entries(self):
+        """ Generator yielding one `BundleEntry` instance per entry, owned by
+        `bundle`. Can only be iterated once.
+        
+        :raises: ValueError if the JSON is malformed
+        :raises: FHIRValidationError if an entry or, once all entries have
+            been read, the Bundle is invalid and `strict`
+        """
+        if self._has_entries:
+            self._has_entries = False
+            for entry in self._read_array():
+                self.num_entries += 1
+                instance = bundle.BundleEntry(entry, strict=self.strict)
+                instance._owner = self.bundle
+                yield instance
+            
+            if not self._peek_is('}'):
+                self._expect(',')
+                if self._read_members():
+                    raise ValueError("Bundle has more than one \"entry\" array")
+            else:
+                self._expect('}')
+            self._complete_bundle()
+    
+    def resources(self):
+        """ Generator yielding the resource of each entry that has one.
+        """
+        for entry in self.entries():
+            if entry.resource is not None:
+                yield entry.resource
+    
+    def _instantiate_bundle(self):
+        if 'Bundle' != self._jsondict.get('resourceType'):
+            raise ValueError("Expecting a JSON Bundle, but \"resourceType\" is {}"
+                .format(self._jsondict.get('resourceType')))
+        self._num_leading = len(self._jsondict)
+        return bundle.Bundle.with_json_lazily(self._jsondict, self.strict)
+    
+    def _complete_bundle(self):
+        """ Instantiates the values of `bundle`, now that all have been
+        read into the dictionary it was created from. Updates it in place
+        instead if it has been used before and values followed the entries,
+        as the entries already point to it.
+        """
+        if self.bundle._lazy is not None:
+            self.bundle._materialize()
+        elif len(self._jsondict) > self._num_leading:
+            try:
+                self.bundle.update_with_json(self._jsondict)
+            except fhirabstractbase.FHIRValidationError as e:
+                if self.strict:
+                    raise
+                for err in e.errors:
+                    logging.warning(err)
+    
+    
+    # MARK: Tokenizing
+    
+    # The generator's "fhirbundle.py" has the same tokenizer, which these
+    # models cannot import; keep the two in step.
+    
+    def _read_members(self):
+        """ Collects top-level values into `_jsondict` until either the
+        "entry" array starts, returning True, or the Bundle ends.
+        """
+        while True:
+            key = self._read_value()
+            self._expect(':')
+            if 'entry' == key:
+                return True
+            self._jsondict[key] = self._read_value()
+            if self._peek_is('}'):
+                self._expect('}')
+                return False
+            self._expect(',')
+    
+    def _read_array(self):
+        self._expect('[')
+        if self._peek_is(']'):
+            self._expect(']')
+            return
+        while True:
+            yield self._read_value()
+            if self._peek_is(']'):
+                break
+            self._expect(',')
+        self._expect(']')
+    
+    def _read_value(self):
+        """ Decodes the next complete JSON value, pulling more data from the
+        stream until the decoder succeeds. Numbers and literals are only
+        accepted once a delimiter follows, so they cannot be cut in half.
+        """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                if self._eof or (end < len(self._buffer) and self._buffer[end] in ' \t\n\r,:]}'):
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+    
+    def _expect(self, char):
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise ValueError("Unexpected end of data, expecting \"{}\"".format(char))
+        if char != self._buffer[self._pos]:
+            raise ValueError("Expecting \"{}\" but found \"{}\"".format(char, self._buffer[self._pos]))
+        self._pos += 1
+    
+    def _peek_is(self, char):
+        self._skip_whitespace()
+        return self._pos < len(self._buffer) and char == self._buffer[self._pos]
+    
+    def _skip_whitespace(self):
+        while True:
+            buf = self._buffer
+            while self._pos < len(buf) and buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(buf) or self._eof:
+                return
+            self._fill()
+    
+    def _fill(self):
+        """ Drops consumed data from the buffer and appends the next chunk.
+        Grows the chunk while a single value keeps failing to decode, so huge
+        entries are not re-scanned once per small chunk.
+        """
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        chunk = self.handle.read(max(self.chunk_size, len(self._buffer)))
+        if not chunk:
+            self._eof = True
+        else:
+            if not self._started:
+                self._started = True
+                chunk = chunk.lstrip(u'\ufeff')      # a UTF-8 byte order mark
+            self._buffer += chunk
+
+
+from . import bundle
+from . import fhirabstractbase
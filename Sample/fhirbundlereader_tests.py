@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import io
+import json
+import unittest
+from .fhirbundlereader import FHIRBundleReader
+from .fhirabstractbase import FHIRValidationError
+
+
+class FHIRBundleReaderTests(unittest.TestCase):
+    def reader_for(self, jsondict, strict=True, prefix=b''):
+        return FHIRBundleReader(io.BytesIO(prefix + json.dumps(jsondict).encode('utf-8')), strict=strict)
+    
+    def testEntriesBeforeType(self):
+        reader = self.reader_for({
+            "resourceType": "Bundle",
+            "entry": [{"fullUrl": "urn:uuid:1"}, {"fullUrl": "urn:uuid:2"}],
+            "type": "collection",
+        })
+        urls = [entry.fullUrl for entry in reader.entries()]
+        self.assertEqual(urls, ["urn:uuid:1", "urn:uuid:2"])
+        self.assertEqual(reader.bundle.type, "collection")
+        self.assertIsNone(reader.bundle.entry)
+    
+    def testTypeBeforeEntries(self):
+        reader = self.reader_for({
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "total": 2,
+            "entry": [{"fullUrl": "urn:uuid:1"}, {"fullUrl": "urn:uuid:2"}],
+        })
+        self.assertEqual(reader.bundle.total, 2)
+        entries = list(reader.entries())
+        self.assertEqual(len(entries), 2)
+        self.assertIs(entries[0].owningBundle(), reader.bundle)
+    
+    def testByteOrderMark(self):
+        reader = self.reader_for({
+            "resourceType": "Bundle",
+            "type": "collection",
+            "entry": [{"fullUrl": "urn:uuid:1"}],
+        }, prefix=u'\ufeff'.encode('utf-8'))
+        self.assertEqual([entry.fullUrl for entry in reader.entries()], ["urn:uuid:1"])
+    
+    def testMissingTypeAfterEntries(self):
+        reader = self.reader_for({
+            "resourceType": "Bundle",
+            "entry": [{"fullUrl": "urn:uuid:1"}],
+        })
+        with self.assertRaises(FHIRValidationError):
+            list(reader.entries())
+    
+    def testMissingTypeWithoutEntries(self):
+        with self.assertRaises(FHIRValidationError):
+            self.reader_for({"resourceType": "Bundle", "total": 0})
+    
+    def testNotStrict(self):
+        reader = self.reader_for({
+            "resourceType": "Bundle",
+            "entry": [{"fullUrl": "urn:uuid:1"}],
+            "foo": "bar",
+        }, strict=False)
+        self.assertEqual(len(list(reader.entries())), 1)
+        self.assertIsNone(reader.bundle.type)
+    
+    def testSuperfluousKeyAfterEntries(self):
+        reader = self.reader_for({
+            "resourceType": "Bundle",
+            "type": "batch",
+            "entry": [{"fullUrl": "urn:uuid:1"}],
+            "foo": "bar",
+        })
+        with self.assertRaises(FHIRValidationError):
+            list(reader.entries())
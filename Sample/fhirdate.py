@@ -4,42 +4,47 @@
 #  Facilitate working with dates.
 #  2014, SMART Health IT.
 
+import re
 import sys
 import logging
 import isodate
 import datetime
+import functools
 
 
 class FHIRDate(object):
     """ Facilitate working with dates.
     
     - `date`: datetime object representing the receiver's date-time
+    
+    The JSON string is only parsed when `date` is first accessed, and
+    `as_json()` returns it untouched unless `date` has been assigned.
     """
     
     def __init__(self, jsonval=None):
-        self.date = None
-        if jsonval is not None:
-            isstr = isinstance(jsonval, str)
-            if not isstr and sys.version_info[0] < 3:       # Python 2.x has 'str' and 'unicode'
-                isstr = isinstance(jsonval, basestring)
-            if not isstr:
-                raise TypeError("Expecting string when initializing {}, but got {}"
-                    .format(type(self), type(jsonval)))
+        if jsonval is not None and not isinstance(jsonval, _str_types):
+            raise TypeError("Expecting string when initializing {}, but got {}"
+                .format(type(self), type(jsonval)))
+        self._date = None
+        self._parsed = jsonval is None
+        self.origval = jsonval
+    
+    @property
+    def date(self):
+        if not self._parsed:
             try:
-                if 'T' in jsonval:
-                    self.date = isodate.parse_datetime(jsonval)
-                else:
-                    self.date = isodate.parse_date(jsonval)
+                self._date = _parse(self.origval)
             except Exception as e:
                 logging.warning("Failed to initialize FHIRDate from \"{}\": {}"
-                    .format(jsonval, e))
-        
-        self.origval = jsonval
+                    .format(self.origval, e))
+            self._parsed = True
+        return self._date
     
-    def __setattr__(self, prop, value):
-        if 'date' == prop:
-            self.origval = None
-        object.__setattr__(self, prop, value)
+    @date.setter
+    def date(self, value):
+        self._date = value
+        self._parsed = True
+        self.origval = None
     
     @property
     def isostring(self):
@@ -47,16 +52,15 @@ class FHIRDate(object):
             return None
         if isinstance(self.date, datetime.datetime):
             return isodate.datetime_isoformat(self.date)
+        if isinstance(self.date, datetime.time):
+            return isodate.time_isoformat(self.date)
         return isodate.date_isoformat(self.date)
     
     @classmethod
     def with_json(cls, jsonobj):
         """ Initialize a date from an ISO date string.
         """
-        isstr = isinstance(jsonobj, str)
-        if not isstr and sys.version_info[0] < 3:       # Python 2.x has 'str' and 'unicode'
-            isstr = isinstance(jsonobj, basestring)
-        if isstr:
+        if isinstance(jsonobj, _str_types):
             return cls(jsonobj)
         
         if isinstance(jsonobj, list):
@@ -76,4 +80,61 @@ class FHIRDate(object):
         if self.origval is not None:
             return self.origval
         return self.isostring
+
+
+_str_types = (str, unicode) if sys.version_info < (3, 0) else (str,)
+
+# FHIR's date, dateTime and instant, which may leave out everything after the
+# year or month (e.g. "2018-05"), and time
+_datetime_re = re.compile(r'(\d{4})(?:-(\d{2})(?:-(\d{2})'
+    r'(?:T(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?(Z|([+-])(\d{2}):(\d{2}))?)?)?)?\Z')
+_time_re = re.compile(r'(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?\Z')
+_tzinfos = {'Z': isodate.UTC}      # by designator, the regex allows at most a few thousand
+
+def _parse_uncached(string):
+    """ Parses a FHIR date, dateTime, instant or time string into a date,
+    datetime or time instance. Strings the FHIR grammar does not cover,
+    or out-of-range values like "24:00:00", are left to `isodate`, which is
+    more lenient.
     
+    :raises: ValueError (or isodate.ISO8601Error) if the string is invalid
+    """
+    try:
+        parsed = _parse_fhir(string)
+        if parsed is not None:
+            return parsed
+    except ValueError:
+        pass
+    if 'T' in string:
+        return isodate.parse_datetime(string)
+    return isodate.parse_date(string)
+
+def _parse_fhir(string):
+    match = _datetime_re.match(string)
+    if match is not None:
+        year, month, day, hour, minute, second, fraction, tzname, tzsign, tzhour, tzmin = match.groups()
+        if hour is None:
+            return datetime.date(int(year), int(month or 1), int(day or 1))
+        tzinfo = _tzinfos.get(tzname)
+        if tzinfo is None and tzname is not None:
+            sign = -1 if '-' == tzsign else 1
+            tzinfo = _tzinfos[tzname] = isodate.FixedOffset(sign * int(tzhour), sign * int(tzmin), tzname)
+        return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute),
+            int(second), _microseconds(fraction), tzinfo)
+    
+    match = _time_re.match(string)
+    if match is not None:
+        hour, minute, second, fraction = match.groups()
+        return datetime.time(int(hour), int(minute), int(second), _microseconds(fraction))
+    return None
+
+def _microseconds(fraction):
+    """ Truncates, like isodate, rather than rounds. """
+    return int((fraction + '00000')[:6]) if fraction else 0
+
+# strings seen recently are parsed only once, their (immutable) instances are
+# shared; failures are not cached and logged every time
+if sys.version_info < (3, 2):       # no functools.lru_cache
+    _parse = _parse_uncached
+else:
+    _parse = functools.lru_cache(maxsize=4096)(_parse_uncached)
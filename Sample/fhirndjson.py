@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Stream resources out of FHIR Bulk Data NDJSON files.
+
+import io
+import os
+import gzip
+import json
+import time
+import logging
+import collections
+import multiprocessing
+
+
+class FHIRNDJSONError(Exception):
+    """ Exception yielded, not raised, by `FHIRNDJSONReader` for a line that
+    could not be turned into a resource.
+    """
+    
+    def __init__(self, filename, line, error):
+        """ Initializer.
+        
+        :param str filename: The file the line was read from
+        :param int line: The 1-based number of the offending line
+        :param error: The Exception that occurred, typically a ValueError for
+            malformed JSON or a FHIRValidationError
+        """
+        super(FHIRNDJSONError, self).__init__(filename, line, error)
+        
+        self.filename = filename
+        self.line = line
+        self.error = error
+    
+    def __str__(self):
+        return "{}, line {}: {}".format(self.filename, self.line, self.error)
+
+
+class FHIRNDJSONReader(object):
+    """ Reads NDJSON files, as produced by FHIR Bulk Data exports, one line at
+    a time and instantiates each line's resource through the element
+    factory, based on its "resourceType".
+    
+    Files may be gzip-compressed, which is detected from their first bytes.
+    Lines are consumed as they are read, so memory use does not depend on
+    the size of the files. With more than one worker, plain files are split
+    into byte ranges of `shard_size` which the workers of a process pool
+    read and instantiate themselves; results are yielded in file order and
+    at most two shards per worker are in flight. A gzip stream cannot be
+    entered in the middle, so each compressed file is one shard, read by
+    one worker, and all of its results are held in memory at once; split
+    large exports into several files to keep memory down and workers busy.
+    Sending instances back from workers costs more than creating them, so
+    pass a `handler` that does the work on each resource where it was
+    created and only returns what the caller needs.
+    
+    After reading, `num_resources`, `num_errors` and `seconds` describe the
+    last call to `read()`, see also `resources_per_second()`.
+    """
+    
+    def __init__(self, workers=1, shard_size=1 << 20, handler=None):
+        self.workers = workers
+        """ Number of processes to instantiate resources in; 1 to not use
+        a process pool. """
+        
+        self.shard_size = shard_size
+        """ Number of bytes of a plain file handed to a worker process at
+        a time; lines belong to the shard they start in. """
+        
+        self.handler = handler
+        """ Callable receiving each resource, whose return value is yielded
+        instead of the resource. Must be picklable when using workers. """
+        
+        self.num_resources = 0
+        self.num_errors = 0
+        self.seconds = 0.0
+        self._lines_before = 0
+    
+    def read(self, *filepaths):
+        """ Generator yielding one item per non-empty line of the given
+        files: an instance of the line's resource class, or what `handler`
+        returned for it, or, if the line could not be decoded or validated,
+        a `FHIRNDJSONError`.
+        
+        :param filepaths: One or more paths to NDJSON files
+        """
+        self.num_resources = 0
+        self.num_errors = 0
+        self.seconds = 0.0
+        started = time.time()
+        
+        if self.workers > 1:
+            results = self._instantiate_in_pool(filepaths)
+        else:
+            results = (_instantiate(filename, num, line, self.handler)
+                for filename in filepaths
+                for num, line in _read_lines(filename)
+                if line.strip())
+        
+        try:
+            for result in results:
+                if isinstance(result, FHIRNDJSONError):
+                    self.num_errors += 1
+                else:
+                    self.num_resources += 1
+                yield result
+        finally:
+            results.close()         # terminates the pool if closed early
+            self.seconds = time.time() - started
+            logging.info("Read {} resources and {} invalid lines in {:.1f} s, {:.0f} resources/s"
+                .format(self.num_resources, self.num_errors, self.seconds, self.resources_per_second()))
+    
+    def resources_per_second(self):
+        """ The throughput of the last `read()`, counting valid resources.
+        """
+        return self.num_resources / self.seconds if self.seconds > 0 else 0.0
+    
+    def _instantiate_in_pool(self, filepaths):
+        pending = collections.deque()
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            for shard in self._shards(filepaths):
+                if len(pending) >= 2 * self.workers:
+                    for result in self._collect(*pending.popleft()):
+                        yield result
+                pending.append((shard, pool.apply_async(_instantiate_shard, (shard, self.handler))))
+            while pending:
+                for result in self._collect(*pending.popleft()):
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
+    
+    def _shards(self, filepaths):
+        """ Splits the files into (filename, start, end) byte ranges for
+        the workers to read; `end` is None for a whole gzip-compressed file.
+        """
+        for filename in filepaths:
+            with io.open(filename, 'rb') as handle:
+                is_gzip = b'\x1f\x8b' == handle.read(2)
+            if is_gzip:
+                yield (filename, 0, None)
+                continue
+            size = os.path.getsize(filename)
+            for start in range(0, size, self.shard_size):
+                yield (filename, start, min(start + self.shard_size, size))
+    
+    def _collect(self, shard, async_result):
+        """ Waits for a shard's results. Workers number lines from the
+        start of their shard, which is the line after all lines of the
+        file's preceding shards, so errors are renumbered here.
+        """
+        filename, start, end = shard
+        if 0 == start:
+            self._lines_before = 0
+        results, num_lines = async_result.get()
+        offset = self._lines_before
+        self._lines_before += num_lines
+        for result in results:
+            if isinstance(result, FHIRNDJSONError):
+                result = FHIRNDJSONError(result.filename, result.line + offset, result.error)
+            yield result
+
+
+def _read_lines(filename, start=0, end=None):
+    """ Yields (line number, bytes) tuples for the lines of a plain or
+    gzip-compressed file or, given `end`, for the lines of a plain file
+    that start within the byte range from `start` to `end`, numbered from
+    1 at the first of these.
+    """
+    with io.open(filename, 'rb') as handle:
+        num = 0
+        if end is None:
+            is_gzip = b'\x1f\x8b' == handle.read(2)
+            handle.seek(0)
+            if is_gzip:
+                handle = gzip.GzipFile(fileobj=handle)
+            for line in handle:
+                num += 1
+                yield num, line
+            return
+        
+        pos = 0
+        if start > 0:       # skip the line started in the preceding shard
+            handle.seek(start - 1)
+            pos = start - 1 + len(handle.readline())
+        while pos < end:
+            line = handle.readline()
+            if not line:
+                break
+            pos += len(line)
+            num += 1
+            yield num, line
+
+
+def _instantiate(filename, num, line, handler):
+    try:
+        jsondict = json.loads(line.decode('utf-8'))
+        if not isinstance(jsondict, dict) or not jsondict.get('resourceType'):
+            raise ValueError("Expecting a JSON object with a \"resourceType\"")
+        resource = fhirelementfactory.FHIRElementFactory.instantiate(jsondict['resourceType'], jsondict)
+    except Exception as e:
+        return FHIRNDJSONError(filename, num, e)
+    return handler(resource) if handler is not None else resource
+
+
+def _instantiate_shard(shard, handler):
+    """ Runs in worker processes, hence module-level. Returns the results
+    and the number of lines, including empty ones, of the shard.
+    """
+    filename, start, end = shard
+    results = []
+    num = 0
+    for num, line in _read_lines(filename, start, end):
+        if line.strip():
+            results.append(_instantiate(filename, num, line, handler))
+    return results, num
+
+
+from . import fhirelementfactory
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from .fhirndjson import FHIRNDJSONReader, FHIRNDJSONError
+
+
+def _bundle_type(bundle):
+    return bundle.type
+
+
+class FHIRNDJSONReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def write(self, filename, lines, compress=False):
+        path = os.path.join(self.directory, filename)
+        data = '\n'.join(lines).encode('utf-8')
+        with (gzip.open(path, 'wb') if compress else open(path, 'wb')) as handle:
+            handle.write(data)
+        return path
+    
+    def bundles(self, count):
+        types = ['batch', 'collection', 'history', 'searchset', 'transaction']
+        return [json.dumps({"resourceType": "Bundle", "type": types[i % len(types)], "id": str(i)})
+            for i in range(count)]
+    
+    def read(self, *paths, **kwargs):
+        reader = FHIRNDJSONReader(**kwargs)
+        return reader, list(reader.read(*paths))
+    
+    def testBadAndBlankLines(self):
+        lines = self.bundles(5)
+        lines[1] = '{"resourceType": "Bundle", "bogus": 1}'
+        lines[2] = '{not json'
+        lines.insert(3, '')
+        lines.insert(4, '   ')
+        path = self.write('bundles.ndjson', lines)
+        for workers in (1, 3):
+            reader, results = self.read(path, workers=workers, shard_size=16)
+            self.assertEqual(5, len(results))
+            self.assertEqual(3, reader.num_resources)
+            self.assertEqual(2, reader.num_errors)
+            self.assertEqual(['0', '3', '4'], [r.id for r in results if not isinstance(r, FHIRNDJSONError)])
+            errors = [r for r in results if isinstance(r, FHIRNDJSONError)]
+            self.assertEqual([2, 3], [e.line for e in errors])
+            self.assertEqual(path, errors[0].filename)
+            self.assertIsInstance(errors[1].error, ValueError)
+    
+    def testGzip(self):
+        lines = self.bundles(20)
+        lines[7] = '{not json'
+        plain = self.write('bundles.ndjson', lines)
+        compressed = self.write('bundles.ndjson.gz', lines, compress=True)
+        for workers in (1, 3):
+            reader, results = self.read(compressed, plain, workers=workers, shard_size=100)
+            self.assertEqual(38, reader.num_resources)
+            errors = [r for r in results if isinstance(r, FHIRNDJSONError)]
+            self.assertEqual([(compressed, 8), (plain, 8)], [(e.filename, e.line) for e in errors])
+    
+    def testOrder(self):
+        lines = self.bundles(200)
+        first = self.write('first.ndjson', lines[:150])
+        second = self.write('second.ndjson', lines[150:])
+        for workers in (1, 3):
+            for shard_size in (1, 64, 1 << 20):
+                reader, results = self.read(first, second, workers=workers, shard_size=shard_size)
+                self.assertEqual([str(i) for i in range(200)], [r.id for r in results])
+    
+    def testHandler(self):
+        path = self.write('bundles.ndjson', self.bundles(10))
+        reader, results = self.read(path, workers=3, shard_size=50, handler=_bundle_type)
+        self.assertEqual(['batch', 'collection', 'history', 'searchset', 'transaction'] * 2, results)
+    
+    def testCloseEarly(self):
+        path = self.write('bundles.ndjson', self.bundles(500))
+        reader = FHIRNDJSONReader(workers=3, shard_size=100)
+        results = reader.read(path)
+        self.assertEqual('0', next(results).id)
+        self.assertTrue(len(multiprocessing.active_children()) > 0)
+        results.close()
+        self.assertEqual([], multiprocessing.active_children())
+        self.assertEqual(1, reader.num_resources)
@@ -11,6 +11,8 @@ class FHIRReference(reference.Reference):
     """ Subclassing FHIR's `Reference` resource to add resolving capabilities.
     """
     
+    __slots__ = ()
+    
     def resolved(self, klass):
         """ Resolves the reference and caches the result, returning instance(s)
         of the referenced classes.
@@ -0,0 +1,11 @@
+# Example settings for generating the Python classes in "Sample", see the
+# README on how to use them.
+
+from Default.settings import *
+
+
+# Copy the tests of the readers in "Sample" next to the generated unit tests
+unittest_copyfiles = [
+    'Sample/fhirbundlereader_tests.py',
+    'Sample/fhirndjson_tests.py',
+]
@@ -4,11 +4,55 @@
 #  Generated from FHIR {{ info.version }} on {{ info.date }}.
 #  {{ info.year }}, SMART Health IT.
 
+import sys
+import importlib
+
 
 class FHIRElementFactory(object):
     """ Factory class to instantiate resources by resource name.
+    
+    Classes are looked up by resource type and only imported when first
+    needed, after which they are cached in `_classes`. Use `register()` to
+    have the factory instantiate your own class, e.g. for a profile.
     """
     
+    _modules = {
+    {%- for klass in classes %}{% if klass.resource_type %}
+        "{{ klass.resource_type }}": ("{{ klass.module }}", "{{ klass.name }}"),
+    {%- endif %}{% endfor %}
+    }
+    """ Module and class name per resource type. """
+    
+    _classes = {}
+    """ Classes per resource type that have been imported or registered. """
+    
+    @classmethod
+    def register(cls, resource_type, klass):
+        """ Makes the factory use the given class for "resource_type",
+        replacing the generated class, if there is one.
+        
+        :param str resource_type: The name/type of the resource
+        :param klass: The class to instantiate for that type
+        """
+        cls._classes[resource_type] = klass
+    
+    @classmethod
+    def class_for(cls, resource_type):
+        """ Returns the class correlating to "resource_type".
+        
+        :param str resource_type: The name/type of the resource
+        :returns: The class for the respective type or `Element`
+        """
+        if not isinstance(resource_type, _str_types):       # e.g. a list in invalid JSON
+            resource_type = None
+        klass = cls._classes.get(resource_type)
+        if klass is None:
+            module, name = cls._modules.get(resource_type, ("element", "Element"))
+            klass = getattr(importlib.import_module('.' + module, __package__), name)
+            if resource_type in cls._modules:
+                cls._classes[resource_type] = klass
+        return klass
+    
     @classmethod
     def instantiate(cls, resource_type, jsondict):
         """ Instantiate a resource of the type correlating to "resource_type".
@@ -17,11 +61,7 @@ class FHIRElementFactory(object):
         :param dict jsondict: The JSON dictionary to use for data
         :returns: A resource of the respective type or `Element`
         """
-        {%- for klass in classes %}{% if klass.resource_type %}
-        if "{{ klass.resource_type }}" == resource_type:
-            from . import {{ klass.module }}
-            return {{ klass.module }}.{{ klass.name }}(jsondict)
-        {%- endif %}{% endfor %}
-        from . import element
-        return element.Element(jsondict)
+        return cls.class_for(resource_type)(jsondict)
+
 
+_str_types = (str, unicode) if sys.version_info < (3, 0) else (str,)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Generated from FHIR {{ info.version }} on {{ info.date }}.
+#  {{ info.year }}, SMART Health IT.
+#
+#  Modules and the classes they define are imported when first accessed as
+#  attributes of the package, e.g. `models.Patient` (needs Python 3.7).
+
+import importlib
+
+
+_class_modules = {
+{%- for klass in classes %}
+    "{{ klass.name }}": "{{ klass.module }}",
+{%- endfor %}
+}
+""" The module each class is defined in. """
+
+_modules = frozenset([
+{%- for module in modules %}
+    "{{ module }}",
+{%- endfor %}
+])
+
+
+def __getattr__(name):
+    module = _class_modules.get(name)
+    if module is not None:
+        value = getattr(importlib.import_module('.' + module, __name__), name)
+    elif name in _modules:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_class_modules) | _modules)
@@ -25,6 +25,21 @@ class {{ klass.name }}({% if klass.superclass in imports %}{{ klass.superclass.m
     
     resource_type = "{{ klass.resource_type }}"
 {%- endif %}
+{%- if slots %}
+    
+    {% if klass.properties -%}
+    __slots__ = {
+    {%- for prop in klass.properties %}
+        "{{ prop.name }}": """ {{ prop.short|wordwrap(67, wrapstring="\n        ") }}.
+        {% if prop.is_array %}List of{% else %}Type{% endif %} `{{ prop.class_name }}`{% if prop.is_array %} items{% endif %}
+        {%- if prop.reference_to_names|length > 0 %} referencing `{{ prop.reference_to_names|join(', ') }}`{% endif %}
+        {%- if prop.json_class != prop.class_name %} (represented as `{{ prop.json_class }}` in JSON){% endif %}. """,
+    {%- endfor %}
+    }
+    {%- else -%}
+    __slots__ = ()
+    {%- endif %}
+{%- else %}
     
     def __init__(self, jsondict=None, strict=True):
         """ Initialize all valid properties.
@@ -43,6 +58,7 @@ class {{ klass.name }}({% if klass.superclass in imports %}{{ klass.superclass.m
     {%- endfor %}
         
         super({{ klass.name }}, self).__init__(jsondict=jsondict, strict=strict)
+{%- endif %}
     
 {%- if klass.properties %}
     
@@ -65,10 +81,122 @@ class {{ klass.name }}({% if klass.superclass in imports %}{{ klass.superclass.m
         ])
         return js
     
+{%- if from_json %}
+    {%- for prop in klass.properties %}
+    {%- set typ %}{% if prop.module_name %}{{ prop.module_name }}.{% endif %}{{ prop.class_name }}{% endset %}
+    {%- set matching %}{% if 'int' == prop.class_name or 'float' == prop.class_name %}(int, float){% elif 'str' == prop.class_name %}self._str_types{% else %}{{ typ }}{% endif %}{% endset %}
+    
+    def _read_json_{{ prop.name }}(self, value, found):
+        {%- if 'element' == klass.module and 'Element' == klass.name and prop.module_name %}
+        from . import {{ prop.module_name }}
+        {%- endif %}
+        {%- if prop.json_class != prop.class_name %}
+        try:
+            value = {{ typ }}.with_json_and_owner(value, self)
+        except Exception as e:
+            return e
+        {%- endif %}
+        found.add("{{ prop.orig_name }}")
+        {%- if prop.one_of_many %}
+        found.add("{{ prop.one_of_many }}")
+        {%- endif %}
+        {%- if prop.is_array %}
+        if not isinstance(value, list):
+            self.{{ prop.name }} = value
+            return TypeError("Wrong type {} for list property \"{{ prop.name }}\" on {}, expecting a list of {}"
+                .format(type(value), type(self), {{ typ }}))
+        if len(value) > 0 and value[0] is not None and not isinstance(value[0], {{ matching }}):
+            return TypeError("Wrong type {} for property \"{{ prop.name }}\" on {}, expecting {}"
+                .format(type(value[0]), type(self), {{ typ }}))
+        {%- else %}
+        if not isinstance(value, {{ matching }}):
+            return TypeError("Wrong type {} for property \"{{ prop.name }}\" on {}, expecting {}"
+                .format(type(value), type(self), {{ typ }}))
+        {%- endif %}
+        self.{{ prop.name }} = value
+    {%- endfor %}
+    
+    _json_readers = {
+    {%- for prop in klass.properties %}
+        "{{ prop.orig_name }}": _read_json_{{ prop.name }},
+    {%- endfor %}
+    }
+
+{%- endif %}
+{%- if to_json %}
+    
+    def _write_json(self, js, errs, found):
+        {%- if 'FHIRAbstractBase' != klass.superclass.name %}
+        {% if klass.superclass in imports %}{{ klass.superclass.module }}.{% endif %}{{ klass.superclass.name }}._write_json(self, js, errs, found)
+        {%- endif %}
+    {%- for prop in klass.properties %}
+    {%- set typ %}{% if prop.module_name %}{{ prop.module_name }}.{% endif %}{{ prop.class_name }}{% endset %}
+    {%- set matching %}{% if 'int' == prop.class_name or 'float' == prop.class_name %}(int, float){% elif 'str' == prop.class_name %}self._str_types{% else %}{{ typ }}{% endif %}{% endset %}
+        {%- if not loop.first or 'FHIRAbstractBase' != klass.superclass.name %}
+        {# #}
+        {%- endif %}
+        value = self.{{ prop.name }}
+        if value is not None:
+        {%- if 'element' == klass.module and 'Element' == klass.name and prop.module_name %}
+            from . import {{ prop.module_name }}
+        {%- endif %}
+        {%- if prop.is_array %}
+            if not isinstance(value, list):
+                errs.append(fhirabstractbase.FHIRValidationError([TypeError("Expecting property \"{{ prop.name }}\" on {} to be list, but is {}"
+                    .format(type(self), type(value)))], "{{ prop.name }}"))
+            elif len(value) > 0:
+                if value[0] is not None and not isinstance(value[0], {{ matching }}):
+                    errs.append(fhirabstractbase.FHIRValidationError([TypeError("Expecting property \"{{ prop.name }}\" on {} to be {}, but is {}"
+                        .format(type(self), {{ typ }}, type(value[0])))], "{{ prop.name }}"))
+                else:
+                {%- if prop.json_class != prop.class_name %}
+                    lst = []
+                    err = None
+                    for v in value:
+                        try:
+                            lst.append(v.as_json() if hasattr(v, 'as_json') else v)
+                        except fhirabstractbase.FHIRValidationError as e:
+                            err = e.prefixed(str(len(lst))).prefixed("{{ prop.name }}")
+                    if err is not None:
+                        errs.append(err)
+                    js["{{ prop.orig_name }}"] = lst
+                {%- else %}
+                    js["{{ prop.orig_name }}"] = list(value)
+                {%- endif %}
+                {%- if prop.nonoptional %}
+                    found.add("{{ prop.one_of_many or prop.orig_name }}")
+                {%- endif %}
+        {%- else %}
+            if not isinstance(value, {{ matching }}):
+                errs.append(fhirabstractbase.FHIRValidationError([TypeError("Expecting property \"{{ prop.name }}\" on {} to be {}, but is {}"
+                    .format(type(self), {{ typ }}, type(value)))], "{{ prop.name }}"))
+            else:
+            {%- if prop.nonoptional %}
+                found.add("{{ prop.one_of_many or prop.orig_name }}")
+            {%- endif %}
+            {%- if prop.json_class != prop.class_name %}
+                try:
+                    js["{{ prop.orig_name }}"] = value.as_json()
+                except fhirabstractbase.FHIRValidationError as e:
+                    errs.append(e.prefixed("{{ prop.name }}"))
+            {%- else %}
+                js["{{ prop.orig_name }}"] = value
+            {%- endif %}
+        {%- endif %}
+    {%- endfor %}
+
+{%- endif %}
 {%- endif %}
 {%- endfor %}
 
-{% for imp in imports %}{% if imp.module not in imported %}
-from . import {{ imp.module }}
+{% set deferred = [] %}
+{%- for imp in imports %}{% if imp.module not in imported and imp.module not in deferred %}
+{%- set _ = deferred.append(imp.module) %}
 {%- endif %}{% endfor %}
+{%- if (to_json or deferred) and 'fhirabstractbase' not in imported %}
+from . import fhirabstractbase
+{%- endif %}
+{%- for module in deferred %}
+{{ module }} = fhirabstractbase.FHIRLazyModule(__name__, "{{ module }}")
+{%- endfor %}
 
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Benchmark parsing and rendering against a synthetic specification, offline
+#  Writes StructureDefinition and ValueSet bundles and "version.info" to a
+#  temporary directory, then times parse, finalize and render with the
+#  `Sample` templates, once at the base size and once scaled up.
+#  Fails if a phase exceeds the limits in "benchmark-thresholds.json".
+#  Supply "--scale N", "--profiles N", "--depth N", "--choices N", "--concepts N"
+#  and "--codesystems N" to change sizes, "-j N" to use N worker processes,
+#  "--repeat N" to keep the best of N runs and "--report FILE" to write the
+#  results as JSON.
+#  Supply "--models" to also time instantiating the generated classes from JSON
+#  in strict, non-strict and trusted mode (needs the models' dependencies).
+#  Supply "--imports" to also time importing one generated resource module in a
+#  fresh interpreter and count the modules that loads.
+
+import gc
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import importlib
+import subprocess
+
+from Default import settings
+sys.modules.setdefault('settings', settings)     # templates are found relative to "generate.py", which imports it
+
+from logger import logger
+from fhirprofiler import profiler
+import fhirspec
+import fhirrenderer
+
+_thresholds = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-thresholds.json')
+
+_base_url = 'http://hl7.org/fhir/StructureDefinition/'
+
+_primitives = ['boolean', 'integer', 'decimal', 'string', 'uri', 'code', 'id', 'markdown',
+    'date', 'dateTime', 'instant', 'positiveInt', 'unsignedInt', 'base64Binary']
+
+_complex = {
+    'Coding': [('system', 'uri'), ('version', 'string'), ('code', 'code'), ('display', 'string'), ('userSelected', 'boolean')],
+    'CodeableConcept': [('coding', 'Coding*'), ('text', 'string')],
+    'Identifier': [('use', 'code'), ('type', 'CodeableConcept'), ('system', 'uri'), ('value', 'string'), ('period', 'Period')],
+    'Period': [('start', 'dateTime'), ('end', 'dateTime')],
+    'Quantity': [('value', 'decimal'), ('comparator', 'code'), ('unit', 'string'), ('system', 'uri'), ('code', 'code')],
+    'Range': [('low', 'Quantity'), ('high', 'Quantity')],
+    'Annotation': [('author[x]', 'Reference|string'), ('time', 'dateTime'), ('text', 'markdown')],
+    'Reference': [('reference', 'string'), ('identifier', 'Identifier'), ('display', 'string')],
+}
+
+# types cycled through by choice ("[x]") elements
+_choice_types = ['string', 'boolean', 'integer', 'decimal', 'dateTime', 'CodeableConcept', 'Quantity',
+    'Range', 'Period', 'Reference', 'Identifier', 'Annotation', 'Coding', 'markdown', 'date', 'uri']
+
+
+# MARK: Synthetic Specification
+
+def write_spec(directory, profiles, depth, choices, concepts, codesystems):
+    """ Writes a synthetic specification to `directory`.
+    
+    :param int profiles: The number of resources to define
+    :param int depth: How deep to nest backbone elements in each resource
+    :param int choices: How many "[x]" elements each resource has
+    :param int concepts: How many concepts each CodeSystem has
+    :param int codesystems: How many CodeSystems and ValueSets to define
+    """
+    types = [
+        _definition('Element', 'complex-type', None, [
+            _element('Element'),
+            _element('Element.id', 'string'),
+            _element('Element.extension', 'Extension', mx='*'),
+        ]),
+        _definition('BackboneElement', 'complex-type', 'Element', [
+            _element('BackboneElement'),
+            _element('BackboneElement.modifierExtension', 'Extension', mx='*'),
+        ]),
+        _definition('Extension', 'complex-type', 'Element', [
+            _element('Extension'),
+            _element('Extension.url', 'uri', mn=1),
+            _element('Extension.value[x]', '|'.join(_choice_types)),
+        ]),
+    ]
+    for name in _primitives:
+        types.append(_definition(name, 'primitive-type', 'Element', [_element(name)]))
+    for name, props in sorted(_complex.items()):
+        elements = [_element(name)]
+        for prop, typ in props:
+            elements.append(_element('{}.{}'.format(name, prop), typ))
+        types.append(_definition(name, 'complex-type', 'Element', elements))
+    
+    resources = [
+        _definition('Resource', 'resource', None, [
+            _element('Resource'),
+            _element('Resource.id', 'id'),
+            _element('Resource.implicitRules', 'uri'),
+            _element('Resource.language', 'code'),
+        ]),
+        _definition('DomainResource', 'resource', 'Resource', [
+            _element('DomainResource'),
+            _element('DomainResource.contained', 'Resource', mx='*'),
+            _element('DomainResource.extension', 'Extension', mx='*'),
+            _element('DomainResource.modifierExtension', 'Extension', mx='*'),
+        ]),
+        _definition('Bundle', 'resource', 'Resource', [       # the classes in `Sample` need it
+            _element('Bundle'),
+            _element('Bundle.type', 'code', mn=1),
+            _element('Bundle.entry', 'BackboneElement', mx='*'),
+            _element('Bundle.entry.fullUrl', 'uri'),
+            _element('Bundle.entry.resource', 'Resource'),
+        ]),
+    ]
+    for i in range(profiles):
+        resources.append(_resource(i, profiles, depth, choices, codesystems))
+    
+    valuesets = []
+    for i in range(codesystems):
+        valuesets.extend(_codesystem(i, concepts))
+    
+    for filename, entries in [
+            ('profiles-types.json', types),
+            ('profiles-resources.json', resources),
+            ('valuesets.json', valuesets)]:
+        bundle = {
+            'resourceType': 'Bundle',
+            'id': filename[:-5],
+            'type': 'collection',
+            'entry': [{'fullUrl': res['url'], 'resource': res} for res in entries],
+        }
+        with io.open(os.path.join(directory, filename), 'w', encoding='utf-8') as handle:
+            json.dump(bundle, handle, indent=2)
+    
+    with io.open(os.path.join(directory, 'version.info'), 'w', encoding='utf-8') as handle:
+        handle.write('[FHIR]\nFhirVersion=0.0.0-benchmark\nVersion=benchmark\n')
+
+
+def _resource(index, profiles, depth, choices, codesystems):
+    name = 'Synthetic{}'.format(index)
+    elements = [
+        _element(name),
+        _element(name + '.identifier', 'Identifier', mx='*'),
+        _element(name + '.status', 'code', mn=1, binding=_binding(index % codesystems) if codesystems else None),
+        _element(name + '.category', 'CodeableConcept', mx='*'),
+        _element(name + '.subject', 'Reference', targets=['Synthetic{}'.format((index + 1) % profiles)]),
+        _element(name + '.period', 'Period'),
+        _element(name + '.note', 'Annotation', mx='*'),
+        _element(name + '.class', 'string'),
+    ]
+    for i in range(choices):
+        count = 2 + i % 6
+        offset = (index + i) % len(_choice_types)
+        typs = [_choice_types[(offset + t) % len(_choice_types)] for t in range(count)]
+        elements.append(_element('{}.value{}[x]'.format(name, i), '|'.join(typs)))
+    
+    path = name
+    for level in range(depth):
+        path = '{}.{}'.format(path, 'component' if 0 == level else 'part')
+        elements.append(_element(path, 'BackboneElement', mx='*'))
+        elements.append(_element(path + '.code', 'CodeableConcept', mn=1))
+        elements.append(_element(path + '.value[x]', 'Quantity|string|boolean|Range'))
+        elements.append(_element(path + '.performer', 'Reference', mx='*', targets=[name]))
+    if depth > 0:
+        elements.append(_element(name + '.related', None, mx='*', contentReference='#{}.component'.format(name)))
+    
+    return _definition(name, 'resource', 'DomainResource', elements)
+
+
+def _codesystem(index, concepts):
+    url = 'http://hl7.org/fhir/synthetic-codes-{}'.format(index)
+    codes = []
+    for i in range(concepts):
+        concept = {'code': 'code-{}-{}'.format(index, i), 'display': 'Code {} of {}'.format(i, index),
+            'definition': 'The synthetic concept number {} of code system {}.'.format(i, index)}
+        if 0 == i % 10 and i + 3 < concepts:
+            concept['concept'] = [{'code': 'sub-{}-{}-{}'.format(index, i, n)} for n in range(3)]
+        codes.append(concept)
+    
+    return [
+        {
+            'resourceType': 'CodeSystem',
+            'id': 'synthetic-codes-{}'.format(index),
+            'url': url,
+            'name': 'SyntheticCodes{}'.format(index),
+            'status': 'active',
+            'content': 'complete',
+            'description': 'Synthetic code system number {}'.format(index),
+            'concept': codes,
+        },
+        {
+            'resourceType': 'ValueSet',
+            'id': 'synthetic-codes-{}'.format(index),
+            'url': 'http://hl7.org/fhir/ValueSet/synthetic-codes-{}'.format(index),
+            'name': 'SyntheticCodes{}'.format(index),
+            'status': 'active',
+            'compose': {'include': [{'system': url}]},
+        },
+    ]
+
+
+def _binding(index):
+    return {'strength': 'required', 'valueSet': 'http://hl7.org/fhir/ValueSet/synthetic-codes-{}'.format(index)}
+
+
+def _definition(name, kind, base, elements):
+    definition = {
+        'resourceType': 'StructureDefinition',
+        'id': name,
+        'url': _base_url + name,
+        'name': name,
+        'status': 'active',
+        'kind': kind,
+        'abstract': False,
+        'type': name,
+        'differential': {'element': elements},
+    }
+    if base is not None:
+        definition['baseDefinition'] = _base_url + base
+    return definition
+
+
+def _element(path, types=None, mn=0, mx='1', targets=None, binding=None, **kwargs):
+    """ An ElementDefinition; `types` is a "|"-separated string of type codes
+    where a trailing "*" means many.
+    """
+    if types and types.endswith('*'):
+        types = types[:-1]
+        mx = '*'
+    element = {
+        'id': path,
+        'path': path,
+        'short': 'Short description of {}'.format(path),
+        'definition': 'The formal definition of {}, long enough to need wrapping when written out as a docstring by the templates.'.format(path),
+        'min': mn,
+        'max': mx,
+    }
+    if types:
+        element['type'] = []
+        for code in types.split('|'):
+            typ = {'code': code}
+            if 'Reference' == code and targets:
+                typ['targetProfile'] = [_base_url + t for t in targets]
+            element['type'].append(typ)
+    if binding is not None:
+        element['binding'] = binding
+    element.update(kwargs)
+    return element
+
+
+# MARK: Benchmarking
+
+def run(sizes, workers, repeat):
+    """ Writes a synthetic spec of the given sizes, then parses and renders
+    it `repeat` times.
+    
+    :returns: A dict with the best "parse", "finalize" and "render" seconds
+    """
+    directory = tempfile.mkdtemp(prefix='fhir-benchmark-')
+    try:
+        specdir = os.path.join(directory, 'spec')
+        os.mkdir(specdir)
+        write_spec(specdir, **sizes)
+        
+        _configure(os.path.join(directory, 'models'), workers)
+        
+        best = {}
+        for i in range(repeat):
+            fhirrenderer._wordwrap.cache_clear()
+            profiler.enable()
+            with profiler.phase('parse'):
+                spec = fhirspec.FHIRSpec(specdir, settings)
+            with profiler.phase('write'):
+                spec.write()
+            
+            phases = {p['name']: p['wall_s'] for p in profiler.phases}
+            times = {
+                'parse': phases['parse/prepare'] + phases['parse/read profiles'],
+                'finalize': phases['parse/finalize'],
+                'render': phases['write'],
+            }
+            for phase, seconds in times.items():
+                best[phase] = min(seconds, best.get(phase, seconds))
+        return best
+    finally:
+        shutil.rmtree(directory)
+
+
+def _configure(target, workers):
+    """ Makes the generator write classes (only) to `target`, from scratch.
+    """
+    settings.tpl_resource_target = target
+    settings.tpl_factory_target = os.path.join(target, 'fhirelementfactory.py')
+    settings.write_unittests = False
+    settings.write_dependencies = False
+    settings.write_package = False
+    settings.incremental_rendering = False
+    settings.tpl_bytecode_cache = None
+    settings.tpl_precompiled_target = None
+    settings.parallel_workers = workers
+
+
+def run_models(sizes, repeat):
+    """ Renders the classes of a synthetic spec of the given sizes, then
+    instantiates each resource from JSON giving all of its properties a
+    value, `repeat` times in each mode. Modes take turns going first and
+    run without garbage collection, which would otherwise charge one mode
+    for garbage left by another.
+    
+    :returns: A dict with the best microseconds per resource for "strict",
+        "non-strict" and "trusted" instantiation
+    """
+    directory = tempfile.mkdtemp(prefix='fhir-benchmark-')
+    try:
+        specdir = os.path.join(directory, 'spec')
+        os.mkdir(specdir)
+        write_spec(specdir, **sizes)
+        
+        package = 'benchmarkmodels'
+        _configure(os.path.join(directory, package), 1)
+        fhirspec.FHIRSpec(specdir, settings).write()
+        io.open(os.path.join(directory, package, '__init__.py'), 'w').close()
+        
+        sys.path.insert(0, directory)
+        try:
+            classes = []
+            for i in range(sizes['profiles']):
+                name = 'Synthetic{}'.format(i)
+                classes.append(getattr(importlib.import_module('{}.{}'.format(package, name.lower())), name))
+            docs = [(klass, _instance_json(klass, 3)) for klass in classes]    # filling every element grows exponentially with depth
+            
+            # the payloads must be valid, or non-strict mode would time logging
+            for klass, js in docs:
+                klass(js).as_json()
+            
+            modes = [
+                ('strict', lambda klass, js: klass(js)),
+                ('non-strict', lambda klass, js: klass(js, strict=False)),
+                ('trusted', lambda klass, js: klass.with_trusted_json(js)),
+            ]
+            best = {}
+            gc_enabled = gc.isenabled()
+            try:
+                for i in range(repeat):
+                    for mode, instantiate in modes[i % len(modes):] + modes[:i % len(modes)]:
+                        gc.collect()
+                        gc.disable()
+                        started = time.perf_counter()
+                        for klass, js in docs:
+                            instantiate(klass, js)
+                        micros = (time.perf_counter() - started) / len(docs) * 1e6
+                        gc.enable()
+                        best[mode] = min(micros, best.get(mode, micros))
+            finally:
+                if gc_enabled:
+                    gc.enable()
+                else:
+                    gc.disable()
+            return best
+        finally:
+            sys.path.remove(directory)
+            for module in [m for m in sys.modules if m == package or m.startswith(package + '.')]:
+                del sys.modules[module]
+    finally:
+        shutil.rmtree(directory)
+
+
+_import_script = '''
+import sys, json, time
+started = time.perf_counter()
+import {package}.synthetic0
+imported = time.perf_counter() - started
+modules = len([m for m in sys.modules if m.startswith('{package}.')])
+{package}.synthetic0.Synthetic0().elementProperties()
+print(json.dumps({{
+    'import_ms': imported * 1000,
+    'import_modules': modules,
+    'touched_modules': len([m for m in sys.modules if m.startswith('{package}.')]),
+}}))
+'''
+
+def run_imports(sizes, repeat):
+    """ Renders the classes of a synthetic spec of the given sizes with a
+    package `__init__`, then imports the first resource's module in a fresh
+    interpreter `repeat` times.
+    
+    :returns: A dict with the best "import_ms", the number of the package's
+        modules that importing loaded ("import_modules") and that were
+        loaded once the resource's properties had been declared
+        ("touched_modules"), and the number of "modules" in the package
+    """
+    directory = tempfile.mkdtemp(prefix='fhir-benchmark-')
+    try:
+        specdir = os.path.join(directory, 'spec')
+        os.mkdir(specdir)
+        write_spec(specdir, **sizes)
+        
+        package = 'benchmarkmodels'
+        _configure(os.path.join(directory, package), 1)
+        settings.write_package = True
+        settings.tpl_package_target = os.path.join(directory, package, '__init__.py')
+        fhirspec.FHIRSpec(specdir, settings).write()
+        
+        best = None
+        script = _import_script.format(package=package)
+        for i in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', script], cwd=directory)
+            result = json.loads(output.decode('utf-8'))
+            if best is None or result['import_ms'] < best['import_ms']:
+                best = result
+        best['modules'] = len([f for f in os.listdir(os.path.join(directory, package))
+            if f.endswith('.py') and '__init__.py' != f])
+        return best
+    finally:
+        shutil.rmtree(directory)
+
+
+def _instance_json(klass, depth):
+    """ Valid JSON for an instance of `klass`, with a value for every
+    property (one per choice) and elements nested up to `depth` levels;
+    below that only non-optional properties get a value.
+    """
+    js = {}
+    if getattr(klass, 'resource_type', None) == klass.__name__:
+        js['resourceType'] = klass.resource_type
+    groups = set()
+    for name, jsname, typ, is_list, of_many, not_optional in klass().elementProperties():
+        if (depth <= 0 and not not_optional) or of_many in groups:
+            continue
+        if of_many is not None:
+            groups.add(of_many)
+        if hasattr(typ, 'elementProperties'):
+            value = _instance_json(typ, depth - 1)
+        elif hasattr(typ, 'with_json'):         # FHIRDate
+            value = '2018-05-01T12:30:00Z'
+        else:
+            value = {bool: True, int: 1, float: 1.5, str: 'x'}.get(typ)
+            if value is None:
+                continue
+        js[jsname] = [value] if is_list else value
+    return js
+
+
+def main(argv):
+    with io.open(_thresholds, 'r', encoding='utf-8') as handle:
+        thresholds = json.load(handle)
+    
+    parser = argparse.ArgumentParser(description='Benchmark the generator against a synthetic specification')
+    for name, value in sorted(thresholds['sizes'].items()):
+        parser.add_argument('--' + name, type=int, default=value)
+    parser.add_argument('--scale', type=int, default=thresholds['scale'],
+        help='factor to multiply the number of profiles and code systems with for the scaled run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per size to keep the best of')
+    parser.add_argument('-j', dest='workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--report', help='file to write results to, as JSON')
+    parser.add_argument('--models', action='store_true', help='also time instantiating the generated classes')
+    parser.add_argument('--imports', action='store_true', help='also time importing a generated resource module')
+    args = parser.parse_args(argv)
+    
+    logger.setLevel(logging.WARNING)        # measure the generator, not the terminal
+    
+    sizes = {name: getattr(args, name) for name in thresholds['sizes']}
+    scaled = dict(sizes, profiles=sizes['profiles'] * args.scale, codesystems=sizes['codesystems'] * args.scale)
+    base_times = run(sizes, args.workers, args.repeat)
+    scaled_times = run(scaled, args.workers, args.repeat)
+    
+    results = {'sizes': sizes, 'scale': args.scale, 'phases': {}}
+    failures = []
+    print('{:<10} {:>10} {:>10} {:>8}'.format('phase', 'base (s)', 'scaled (s)', 'growth'))
+    for phase in ['parse', 'finalize', 'render']:
+        growth = scaled_times[phase] / base_times[phase] if base_times[phase] > 0 else 0.0
+        results['phases'][phase] = {'base_s': base_times[phase], 'scaled_s': scaled_times[phase], 'growth': growth}
+        print('{:<10} {:>10.3f} {:>10.3f} {:>7.2f}x'.format(phase, base_times[phase], scaled_times[phase], growth))
+        
+        # growth only says something once a phase takes measurable time
+        max_growth = thresholds['max_growth'][phase] * args.scale
+        if growth > max_growth and scaled_times[phase] > thresholds['min_seconds']:
+            failures.append('{} grows {:.2f}x when scaling {}x, expected at most {:.2f}x'
+                .format(phase, growth, args.scale, max_growth))
+        if base_times[phase] > thresholds['max_seconds'][phase]:
+            failures.append('{} takes {:.3f}s, expected at most {:.3f}s'
+                .format(phase, base_times[phase], thresholds['max_seconds'][phase]))
+    
+    if args.models:
+        micros = run_models(sizes, args.repeat)
+        results['models'] = micros
+        print('')
+        print('{:<10} {:>10} {:>8}'.format('models', 'us/res', 'speedup'))
+        for mode in ['strict', 'non-strict', 'trusted']:
+            print('{:<10} {:>10.1f} {:>7.2f}x'.format(mode, micros[mode], micros['strict'] / micros[mode]))
+    
+    if args.imports:
+        imports = run_imports(sizes, args.repeat)
+        results['imports'] = imports
+        print('')
+        print('{:<10} {:>10} {:>8}'.format('imports', 'ms', 'modules'))
+        print('{:<10} {:>10.1f} {:>8}'.format('import', imports['import_ms'],
+            '{}/{}'.format(imports['import_modules'], imports['modules'])))
+        print('{:<10} {:>10} {:>8}'.format('declared', '',
+            '{}/{}'.format(imports['touched_modules'], imports['modules'])))
+    
+    results['failures'] = failures
+    if args.report:
+        with io.open(args.report, 'w', encoding='utf-8') as handle:
+            json.dump(results, handle, indent=2)
+    
+    for failure in failures:
+        print('FAILED: {}'.format(failure))
+    return 1 if len(failures) > 0 else 0
+
+
+if '__main__' == __name__:
+    sys.exit(main(sys.argv[1:]))
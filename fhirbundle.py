@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+
+class FHIRBundleReader(object):
+    """ Reads a JSON Bundle from a text stream one entry at a time.
+    
+    Only the entry currently being decoded is held in memory, plus whatever
+    other top-level values the Bundle carries (`resourceType`, `type`, ...),
+    which are collected in `meta` while streaming.
+    """
+    
+    chunk_size = 1 << 16
+    
+    def __init__(self, handle, name=None):
+        self.handle = handle
+        self.name = name
+        self.meta = {}
+        self.num_entries = 0
+        self.has_entries = False
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._started = False
+        self._decoder = json.JSONDecoder()
+    
+    def entries(self):
+        """ Generator yielding the Bundle's "entry" dictionaries in order.
+        
+        :raises: Exception if the stream does not hold a JSON Bundle
+        """
+        self._expect('{')
+        if not self._peek_is('}'):
+            while True:
+                key = self._read_value()
+                self._expect(':')
+                if 'entry' == key:
+                    self.has_entries = True
+                    for entry in self._read_array():
+                        self.num_entries += 1
+                        yield entry
+                else:
+                    self.meta[key] = self._read_value()
+                    if 'resourceType' == key and 'Bundle' != self.meta[key]:
+                        raise Exception("Can only process \"Bundle\" resources")
+                if self._peek_is('}'):
+                    break
+                self._expect(',')
+        self._expect('}')
+        
+        if 'resourceType' not in self.meta:
+            raise Exception("Expecting \"resourceType\" to be present, but is not in {}"
+                .format(self.name))
+        if not self.has_entries:
+            raise Exception("There are no entries in the Bundle at {}"
+                .format(self.name))
+    
+    
+    # MARK: Tokenizing
+    
+    # Sample/fhirbundlereader.py has the same tokenizer for the generated
+    # models, which cannot import the generator; keep the two in step.
+    
+    def _read_array(self):
+        self._expect('[')
+        if self._peek_is(']'):
+            self._expect(']')
+            return
+        while True:
+            yield self._read_value()
+            if self._peek_is(']'):
+                break
+            self._expect(',')
+        self._expect(']')
+    
+    def _read_value(self):
+        """ Decodes the next complete JSON value, pulling more data from the
+        stream until the decoder succeeds. Numbers and literals are only
+        accepted once a delimiter follows, so they cannot be cut in half.
+        """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                if self._eof or (end < len(self._buffer) and self._buffer[end] in ' \t\n\r,:]}'):
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+    
+    def _expect(self, char):
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise Exception("Unexpected end of data in {}, expecting \"{}\"".format(self.name, char))
+        if char != self._buffer[self._pos]:
+            raise Exception("Expecting \"{}\" at position {} in {} but found \"{}\""
+                .format(char, self._pos, self.name, self._buffer[self._pos]))
+        self._pos += 1
+    
+    def _peek_is(self, char):
+        self._skip_whitespace()
+        return self._pos < len(self._buffer) and char == self._buffer[self._pos]
+    
+    def _skip_whitespace(self):
+        while True:
+            buf = self._buffer
+            while self._pos < len(buf) and buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(buf) or self._eof:
+                return
+            self._fill()
+    
+    def _fill(self):
+        """ Drops consumed data from the buffer and appends the next chunk.
+        Grows the chunk while a single value keeps failing to decode, so huge
+        entries are not re-scanned once per small chunk.
+        """
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        chunk = self.handle.read(max(self.chunk_size, len(self._buffer)))
+        if not chunk:
+            self._eof = True
+        else:
+            if not self._started:
+                self._started = True
+                chunk = chunk.lstrip(u'\ufeff')      # a UTF-8 byte order mark
+            self._buffer += chunk
@@ -8,26 +8,23 @@ class FHIRClass(object):
     """ An element/resource that should become its own class.
     """
     
-    known = {}
-    
     @classmethod
     def for_element(cls, element):
-        """ Returns an existing class or creates one for the given element.
+        """ Returns an existing class or creates one for the given element,
+        looking it up in and registering it with the element's spec.
         Returns a tuple with the class and a bool indicating creation.
         """
         assert element.represents_class
+        spec = element.profile.spec
         class_name = element.name_if_class()
-        if class_name in cls.known:
-            return cls.known[class_name], False
+        klass = spec.class_with_name(class_name)
+        if klass is not None:
+            return klass, False
         
         klass = cls(element)
-        cls.known[class_name] = klass
+        spec.known_classes[class_name] = klass
         return klass, True
     
-    @classmethod
-    def with_name(cls, class_name):
-        return cls.known.get(class_name)
-    
     def __init__(self, element):
         assert element.represents_class
         self.path = element.path
@@ -38,8 +35,13 @@ class FHIRClass(object):
         self.superclass_name = element.superclass_name
         self.short = element.definition.short
         self.formal = element.definition.formal
-        self.properties = []
         self.expanded_nonoptionals = {}
+        self._properties = []                   # in order of addition
+        self._properties_by_name = {}           # name: FHIRClassProperty()
+        self._properties_by_orig_name = {}      # orig_name: FHIRClassProperty()
+        self._sorted_properties = None
+        self._nonexpanded_properties = None
+        self._nonexpanded_nonoptionals = None
     
     def add_property(self, prop):
         """ Add a property to the receiver.
@@ -51,16 +53,25 @@ class FHIRClass(object):
         # do we already have a property with this name?
         # if we do and it's a specific reference, make it a reference to a
         # generic resource
-        for existing in self.properties:
-            if existing.name == prop.name:
-                if 0 == len(existing.reference_to_names):
-                    logger.warning('Already have property "{}" on "{}", which is only allowed for references'.format(prop.name, self.name))
-                else:
-                    existing.reference_to_names.extend(prop.reference_to_names)
-                return
+        existing = self._properties_by_name.get(prop.name)
+        if existing is not None:
+            if 0 == len(existing.reference_to_names):
+                logger.warning('Already have property "{}" on "{}", which is only allowed for references'.format(prop.name, self.name))
+            else:
+                existing.reference_to_names.extend(prop.reference_to_names)
+            return
+        
+        self._properties.append(prop)
+        self._properties_by_name[prop.name] = prop
         
-        self.properties.append(prop)
-        self.properties = sorted(self.properties, key=lambda x: x.name)
+        # like the first match in `properties`, keep the one first by name
+        same_orig = self._properties_by_orig_name.get(prop.orig_name)
+        if same_orig is None or prop.name < same_orig.name:
+            self._properties_by_orig_name[prop.orig_name] = prop
+        
+        self._sorted_properties = None
+        self._nonexpanded_properties = None
+        self._nonexpanded_nonoptionals = None
         
         if prop.nonoptional and prop.one_of_many is not None:
             if prop.one_of_many in self.expanded_nonoptionals:
@@ -68,36 +79,56 @@ class FHIRClass(object):
             else:
                 self.expanded_nonoptionals[prop.one_of_many] = [prop]
     
+    def finalize(self):
+        """ Called once all profiles have been processed; computes the sorted
+        and derived property lists so rendering does not have to.
+        """
+        self.properties
+        self.nonexpanded_properties
+        self.nonexpanded_nonoptionals
+    
+    @property
+    def properties(self):
+        """ The receiver's properties, sorted by name.
+        """
+        if self._sorted_properties is None:
+            self._sorted_properties = sorted(self._properties, key=lambda x: x.name)
+        return self._sorted_properties
+    
     @property
     def nonexpanded_properties(self):
-        nonexpanded = []
-        included = set()
-        for prop in self.properties:
-            if prop.one_of_many:
-                if prop.one_of_many in included:
-                    continue
-                included.add(prop.one_of_many)
-            nonexpanded.append(prop)
-        return nonexpanded
+        if self._nonexpanded_properties is None:
+            nonexpanded = []
+            included = set()
+            for prop in self.properties:
+                if prop.one_of_many:
+                    if prop.one_of_many in included:
+                        continue
+                    included.add(prop.one_of_many)
+                nonexpanded.append(prop)
+            self._nonexpanded_properties = nonexpanded
+        return self._nonexpanded_properties
     
     @property
     def nonexpanded_nonoptionals(self):
-        nonexpanded = []
-        included = set()
-        for prop in self.properties:
-            if not prop.nonoptional:
-                continue
-            if prop.one_of_many:
-                if prop.one_of_many in included:
+        if self._nonexpanded_nonoptionals is None:
+            nonexpanded = []
+            included = set()
+            for prop in self.properties:
+                if not prop.nonoptional:
                     continue
-                included.add(prop.one_of_many)
-            nonexpanded.append(prop)
-        return nonexpanded
+                if prop.one_of_many:
+                    if prop.one_of_many in included:
+                        continue
+                    included.add(prop.one_of_many)
+                nonexpanded.append(prop)
+            self._nonexpanded_nonoptionals = nonexpanded
+        return self._nonexpanded_nonoptionals
     
     def property_for(self, prop_name):
-        for prop in self.properties:
-            if prop.orig_name == prop_name:
-                return prop
+        prop = self._properties_by_orig_name.get(prop_name)
+        if prop is not None:
+            return prop
         if self.superclass:
             return self.superclass.property_for(prop_name)
         return None
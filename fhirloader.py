@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import io
+import time
 import os.path
+import hashlib
+import concurrent.futures
 from logger import logger
+import fhirspecsource
 
 
 class FHIRLoader(object):
@@ -11,16 +15,29 @@ class FHIRLoader(object):
     
     The `needs` dictionary contains as key the local file needed and how to
     get it from the specification URL.
+    
+    Files are downloaded concurrently over one session, streamed to a
+    ".part" file first; interrupted downloads are resumed with a Range
+    request and, if `specification_checksums` in settings has an entry for
+    the file, its SHA-256 is verified before it is moved into place.
+    
+    ZIP archives are only extracted if `expand_spec_archives` is on in
+    settings, the spec is otherwise read straight out of them (see
+    `FHIRSpecSource`).
     """
     needs = {
         'version.info': 'version.info',
         'profiles-resources.json': 'examples-json.zip',
     }
     
-    def __init__(self, settings, cache):
+    chunk_size = 1 << 20
+    timeout = 60
+    
+    def __init__(self, settings, cache, session=None):
         self.settings = settings
         self.base_url = settings.specification_url
         self.cache = cache
+        self.session = session
     
     def load(self, force_download=False, force_cache=False):
         """ Makes sure all the files needed have been downloaded.
@@ -36,31 +53,56 @@ class FHIRLoader(object):
         if not os.path.isdir(self.cache):
             os.mkdir(self.cache)
         
-        # check all files and download if missing
+        # check all files and collect those we need to download
         uses_cache = False
+        remotes = []
+        source = fhirspecsource.FHIRSpecSource(self.cache)
         for local, remote in self.__class__.needs.items():
-            path = os.path.join(self.cache, local)
-            
-            if not os.path.exists(path):
+            if not source.exists(local):
                 if force_cache:
                     raise Exception('Resource missing from cache: {}'.format(local))
-                logger.info('Downloading {}'.format(remote))
-                filename = self.download(remote)
-                
-                # unzip
-                if '.zip' == filename[-4:]:
-                    logger.info('Extracting {}'.format(filename))
-                    self.expand(filename)
+                if remote not in remotes:
+                    remotes.append(remote)
             else:
                 uses_cache = True
         
+        for filename in self.download_all(remotes):
+            
+            # unzip
+            if '.zip' == filename[-4:] and self.settings.expand_spec_archives:
+                logger.info('Extracting {}'.format(filename))
+                self.expand(filename)
+        
         if uses_cache:
             logger.info('Using cached resources, supply "-f" to re-download')
         
         return self.cache
     
-    def download(self, filename):
-        """ Download the given file located on the server.
+    def download_all(self, filenames):
+        """ Downloads the given files concurrently, using up to
+        `download_workers` threads sharing one session.
+        
+        :returns: The local file names in our cache directory, in order
+        """
+        if 0 == len(filenames):
+            return []
+        session = self.session or self.create_session()
+        workers = max(1, min(len(filenames), self.settings.download_workers))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda f: self.download(f, session), filenames))
+    
+    def create_session(self):
+        import requests     # import here as we can bypass its use with a manual download
+        
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(1, self.settings.download_workers))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    def download(self, filename, session=None):
+        """ Download the given file located on the server, retrying up to
+        `download_retries` times on connection and server errors.
         
         :returns: The local file name in our cache directory the file was
             downloaded to
@@ -69,16 +111,71 @@ class FHIRLoader(object):
         
         url = self.base_url+'/'+filename
         path = os.path.join(self.cache, filename)
+        partpath = path + '.part'
+        session = session or self.session or self.create_session()
         
-        ret = requests.get(url)
-        if not ret.ok:
-            raise Exception("Failed to download {}".format(url))
-        with io.open(path, 'wb') as handle:
-            for chunk in ret.iter_content():
-                handle.write(chunk)
+        attempt = 0
+        while True:
+            logger.info('Downloading {}'.format(filename))
+            try:
+                self.fetch(session, url, partpath)
+                self.verify(filename, partpath)
+                break
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code < 500:
+                    raise Exception("Failed to download {}: {}".format(url, e))
+                err = e
+            except (requests.RequestException, IOError) as e:
+                err = e
+            
+            attempt += 1
+            if attempt > self.settings.download_retries:
+                raise Exception("Failed to download {}: {}".format(url, err))
+            logger.warning('Downloading {} failed, retrying: {}'.format(filename, err))
+            time.sleep(min(2 ** attempt, 30))
         
+        os.replace(partpath, path)
         return filename
     
+    def fetch(self, session, url, partpath):
+        """ Streams the resource at `url` to `partpath`, appending to data
+        already there if the server honors a Range request.
+        """
+        offset = os.path.getsize(partpath) if os.path.exists(partpath) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset > 0 else None
+        with session.get(url, headers=headers, stream=True, timeout=self.__class__.timeout) as ret:
+            if 416 == ret.status_code and offset > 0:       # range not satisfiable, we may already have it all
+                total = ret.headers.get('Content-Range', '').rpartition('/')[2]
+                if str(offset) == total:
+                    return
+                os.remove(partpath)
+                raise IOError('Partial download of {} has {} bytes, but the server reports "{}", starting over'
+                    .format(url, offset, ret.headers.get('Content-Range')))
+            ret.raise_for_status()
+            
+            mode = 'ab' if 206 == ret.status_code else 'wb'
+            with io.open(partpath, mode) as handle:
+                for chunk in ret.iter_content(chunk_size=self.__class__.chunk_size):
+                    handle.write(chunk)
+    
+    def verify(self, filename, partpath):
+        """ Checks the downloaded file against its checksum in settings'
+        `specification_checksums`, if there is one. Removes the file and
+        raises an IOError on mismatch, so the next attempt starts over.
+        """
+        expected = self.settings.specification_checksums.get(filename)
+        if not expected:
+            return
+        
+        digest = hashlib.sha256()
+        with io.open(partpath, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(self.__class__.chunk_size), b''):
+                digest.update(chunk)
+        if digest.hexdigest() != expected.lower():
+            os.remove(partpath)
+            raise IOError('Checksum mismatch for {}, expected {} but got {}'
+                .format(filename, expected, digest.hexdigest()))
+    
     def expand(self, local):
         """ Expand the ZIP file at the given path to the cache directory.
         """
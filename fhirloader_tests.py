@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  Run with `python -m unittest fhirloader_tests`, needs `requests`.
+
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import fhirloader
+
+
+class _Settings(object):
+    def __init__(self, url, checksums=None, retries=2):
+        self.specification_url = url
+        self.download_workers = 1
+        self.download_retries = retries
+        self.specification_checksums = checksums or {}
+        self.expand_spec_archives = False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Serves `server.files`, honoring "Range: bytes=N-" requests like a
+    spec server would. Answers with `server.failures` status codes first,
+    one per request, and records each request's Range header.
+    """
+    
+    def do_GET(self):
+        srv = self.server
+        srv.ranges.append(self.headers.get('Range'))
+        if len(srv.failures) > 0:
+            self.send_response(srv.failures.pop(0))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        
+        content = srv.files.get(self.path.lstrip('/'))
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        
+        range_header = self.headers.get('Range')
+        if range_header is None:
+            self.send_response(200)
+        else:
+            offset = int(range_header.split('=')[1].rstrip('-'))
+            if offset >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(content)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(offset, len(content) - 1, len(content)))
+            content = content[offset:]
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def log_message(self, *args):
+        pass
+
+
+class FHIRLoaderTests(unittest.TestCase):
+    content = b'{"resourceType": "Bundle"}' * 1000
+    
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.files = {'spec.json': self.content}
+        self.server.failures = []
+        self.server.ranges = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.cache = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache)
+    
+    def loader(self, **kwargs):
+        return fhirloader.FHIRLoader(_Settings(self.url, **kwargs), self.cache)
+    
+    def write_part(self, content):
+        with io.open(os.path.join(self.cache, 'spec.json.part'), 'wb') as handle:
+            handle.write(content)
+    
+    def downloaded(self):
+        self.assertFalse(os.path.exists(os.path.join(self.cache, 'spec.json.part')))
+        with io.open(os.path.join(self.cache, 'spec.json'), 'rb') as handle:
+            return handle.read()
+    
+    def testDownload(self):
+        self.assertEqual('spec.json', self.loader().download('spec.json'))
+        self.assertEqual(self.content, self.downloaded())
+        self.assertEqual([None], self.server.ranges)
+    
+    def testResumePartialDownload(self):
+        self.write_part(self.content[:1000])
+        self.loader().download('spec.json')
+        self.assertEqual(self.content, self.downloaded())
+        self.assertEqual(['bytes=1000-'], self.server.ranges)
+    
+    def testAlreadyComplete(self):
+        self.write_part(self.content)
+        self.loader().download('spec.json')
+        self.assertEqual(self.content, self.downloaded())
+        self.assertEqual(['bytes={}-'.format(len(self.content))], self.server.ranges)
+    
+    def testLeftoverLongerThanFile(self):
+        self.write_part(self.content + b'garbage')
+        with mock.patch('fhirloader.time.sleep'):
+            self.loader().download('spec.json')
+        self.assertEqual(self.content, self.downloaded())
+        self.assertEqual(['bytes={}-'.format(len(self.content) + 7), None], self.server.ranges)
+    
+    def testChecksumMismatchStartsOver(self):
+        self.write_part(b'X' * 1000)
+        checksum = hashlib.sha256(self.content).hexdigest()
+        with mock.patch('fhirloader.time.sleep') as sleep:
+            self.loader(checksums={'spec.json': checksum}).download('spec.json')
+        self.assertEqual(self.content, self.downloaded())
+        self.assertEqual(['bytes=1000-', None], self.server.ranges)
+        self.assertEqual(1, sleep.call_count)
+    
+    def testChecksumMismatchGivesUp(self):
+        loader = self.loader(checksums={'spec.json': 'ab' * 32}, retries=1)
+        with mock.patch('fhirloader.time.sleep'):
+            with self.assertRaises(Exception):
+                loader.download('spec.json')
+        self.assertFalse(os.path.exists(os.path.join(self.cache, 'spec.json.part')))
+        self.assertFalse(os.path.exists(os.path.join(self.cache, 'spec.json')))
+        self.assertEqual(2, len(self.server.ranges))
+    
+    def testRetryBackoff(self):
+        self.server.failures = [503, 502, 500]
+        with mock.patch('fhirloader.time.sleep') as sleep:
+            self.loader(retries=3).download('spec.json')
+        self.assertEqual(self.content, self.downloaded())
+        self.assertEqual([mock.call(2), mock.call(4), mock.call(8)], sleep.call_args_list)
+    
+    def testRetriesExhausted(self):
+        self.server.failures = [503, 503, 503]
+        with mock.patch('fhirloader.time.sleep') as sleep:
+            with self.assertRaises(Exception):
+                self.loader(retries=2).download('spec.json')
+        self.assertEqual(2, sleep.call_count)
+    
+    def testClientErrorIsNotRetried(self):
+        with mock.patch('fhirloader.time.sleep') as sleep:
+            with self.assertRaises(Exception):
+                self.loader().download('missing.json')
+        self.assertEqual(0, sleep.call_count)
+    
+    def testSessionHook(self):
+        import requests
+        session = requests.Session()
+        loader = fhirloader.FHIRLoader(_Settings(self.url), self.cache, session=session)
+        with mock.patch.object(session, 'get', wraps=session.get) as get:
+            loader.download('spec.json')
+        self.assertEqual(1, get.call_count)
+        self.assertEqual(self.content, self.downloaded())
+
+
+if '__main__' == __name__:
+    unittest.main()
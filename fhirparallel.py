@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import pickle
+import multiprocessing
+
+from fhirprofiler import profiler
+
+_jobs = None
+
+
+def can_fork():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def map_forked(func, items, workers):
+    """ Calls `func` with every item across a pool of forked worker processes
+    and returns the results in the order of `items`.
+    
+    Workers inherit `func` and `items` (and everything they reference) from
+    the parent through fork, so only the job index and the result, plus any
+    timings the profiler recorded in the worker, are pickled. Runs serially
+    with fewer than two workers or items, or where fork is not available.
+    
+    :param func: A callable taking one item, may be a bound method or closure
+    :param list items: The items to map over
+    :param int workers: The maximum number of worker processes
+    :returns: A list with the results of calling `func` on each item
+    """
+    global _jobs
+    if workers is None or workers < 2 or len(items) < 2 or not can_fork():
+        return [func(item) for item in items]
+    
+    _jobs = (func, items)
+    try:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(min(workers, len(items))) as pool:
+            results = pool.map(_run_job, range(len(items)), chunksize=1)
+    finally:
+        _jobs = None
+    
+    for result, timings in results:
+        profiler.merge(timings)
+    return [result for result, timings in results]
+
+
+def _run_job(index):
+    func, items = _jobs
+    with profiler.capture() as timings:
+        result = func(items[index])
+    return result, timings
+
+
+def dumps_shared(obj, shared):
+    """ Pickles `obj`, storing only the key of any object found among the
+    values of `shared` instead of the object itself. Meant for results of
+    `map_forked` jobs that reference objects the parent already has.
+    
+    :param obj: The object to pickle
+    :param dict shared: Picklable keys pointing to objects not to pickle
+    :returns: The pickled data
+    """
+    handle = io.BytesIO()
+    _SharedPickler(handle, shared).dump(obj)
+    return handle.getvalue()
+
+
+def loads_shared(data, shared):
+    """ Unpickles data created by `dumps_shared()`, resolving keys through
+    `shared`.
+    """
+    return _SharedUnpickler(io.BytesIO(data), shared).load()
+
+
+class _SharedPickler(pickle.Pickler):
+    def __init__(self, handle, shared):
+        super(_SharedPickler, self).__init__(handle, pickle.HIGHEST_PROTOCOL)
+        self.shared_keys = {id(obj): key for key, obj in shared.items()}
+    
+    def persistent_id(self, obj):
+        return self.shared_keys.get(id(obj))
+
+
+class _SharedUnpickler(pickle.Unpickler):
+    def __init__(self, handle, shared):
+        super(_SharedUnpickler, self).__init__(handle)
+        self.shared = shared
+    
+    def persistent_load(self, key):
+        return self.shared[key]
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import time
+import datetime
+
+try:
+    import resource
+except ImportError:         # not available on Windows
+    resource = None
+
+
+class FHIRProfiler(object):
+    """ Collects wall time, CPU time and peak memory of a generator run.
+    
+    Phases are timed with `phase()` and may be nested, their names are then
+    joined with "/". Per phase, `rss_delta_kb` is how much the resident set
+    grew (or shrank) during the phase, while `peak_rss_so_far_kb` is the
+    process' peak up to the phase's end, not the phase's own peak. Finer
+    grained work, like processing one profile or rendering one template, is
+    timed with `timed()` and summed up per category and name. Both do
+    nothing unless the profiler is enabled.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.phases = []            # [{name, wall_s, cpu_s, ...}], in the order they finish
+        self.timings = {}           # category: {name: [count, wall seconds, cpu seconds]}
+        self._stack = []
+    
+    def enable(self):
+        """ Starts a new report.
+        """
+        self.enabled = True
+        self.started = (time.perf_counter(), _cpu_time())
+        self.phases = []
+        self.timings = {}
+        self._stack = []
+    
+    def phase(self, name):
+        """ Context manager timing a phase of the run.
+        """
+        return _Phase(self, name)
+    
+    def timed(self, category, name):
+        """ Context manager adding the time spent inside to the timings of
+        `name` in `category`.
+        """
+        return _Timed(self, category, name)
+    
+    def record(self, category, name, wall, cpu):
+        entry = self.timings.setdefault(category, {}).get(name)
+        if entry is None:
+            self.timings[category][name] = [1, wall, cpu]
+        else:
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += cpu
+    
+    def capture(self):
+        """ Context manager collecting timings recorded inside into a new
+        dictionary, which it returns, instead of the receiver's. Used by
+        worker processes to send their timings back to be `merge()`d.
+        """
+        return _Capture(self)
+    
+    def merge(self, timings):
+        for category, names in timings.items():
+            for name, (count, wall, cpu) in names.items():
+                self.record(category, name, wall, cpu)
+                self.timings[category][name][0] += count - 1
+    
+    def report(self):
+        """ Returns the report as a JSON-serializable dictionary.
+        """
+        wall, cpu = self.started or (time.perf_counter(), _cpu_time())
+        timings = {}
+        for category, names in self.timings.items():
+            timings[category] = [{
+                    'name': name,
+                    'count': count,
+                    'wall_s': round(wall_s, 6),
+                    'cpu_s': round(cpu_s, 6),
+                } for name, (count, wall_s, cpu_s) in sorted(names.items(), key=lambda i: -i[1][1])]
+        
+        return {
+            'date': datetime.datetime.now().isoformat(),
+            'argv': sys.argv,
+            'wall_s': round(time.perf_counter() - wall, 6),
+            'cpu_s': round(_cpu_time() - cpu, 6),
+            'peak_rss_kb': _peak_rss_kb(),
+            'children_peak_rss_kb': _peak_rss_kb(children=True),
+            'phases': self.phases,
+            'timings': timings,
+        }
+    
+    def write(self, filepath):
+        with io.open(filepath, 'w', encoding='utf-8') as handle:
+            json.dump(self.report(), handle, indent=2)
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler._stack.append(self.name)
+            self.wall = time.perf_counter()
+            self.cpu = _cpu_time()
+            self.children_cpu = _cpu_time(children=True)
+            self.rss = _rss_kb()
+    
+    def __exit__(self, *exc):
+        if not self.profiler.enabled:
+            return
+        self.profiler.phases.append({
+            'name': '/'.join(self.profiler._stack),
+            'wall_s': round(time.perf_counter() - self.wall, 6),
+            'cpu_s': round(_cpu_time() - self.cpu, 6),
+            'children_cpu_s': round(_cpu_time(children=True) - self.children_cpu, 6),
+            'rss_delta_kb': _difference(_rss_kb(), self.rss),
+            'peak_rss_so_far_kb': _peak_rss_kb(),
+            'children_peak_rss_so_far_kb': _peak_rss_kb(children=True),
+        })
+        self.profiler._stack.pop()
+
+
+class _Timed(object):
+    def __init__(self, profiler, category, name):
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+    
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.wall = time.perf_counter()
+            self.cpu = time.process_time()
+    
+    def __exit__(self, *exc):
+        if self.profiler.enabled:
+            self.profiler.record(self.category, self.name,
+                time.perf_counter() - self.wall, time.process_time() - self.cpu)
+
+
+class _Capture(object):
+    def __init__(self, profiler):
+        self.profiler = profiler
+    
+    def __enter__(self):
+        self.saved = self.profiler.timings
+        self.profiler.timings = {}
+        return self.profiler.timings
+    
+    def __exit__(self, *exc):
+        self.profiler.timings = self.saved
+
+
+def _cpu_time(children=False):
+    """ User and system CPU seconds of this process, or of its terminated
+    child processes.
+    """
+    if not children:
+        return time.process_time()
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rss_kb():
+    """ Current resident set size of this process in KiB, None where this
+    cannot be determined (only Linux' /proc is read).
+    """
+    try:
+        with io.open('/proc/self/statm', 'rb') as handle:
+            pages = int(handle.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def _difference(value, start):
+    if value is None or start is None:
+        return None
+    return value - start
+
+
+def _peak_rss_kb(children=False):
+    """ Peak resident set size in KiB, of this process or the largest of its
+    terminated child processes, since the process started. None where this
+    cannot be determined.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    if 'darwin' == sys.platform:      # macOS reports bytes
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+
+# the profiler used throughout fhir-generator, see `generate.py --profile`
+profiler = FHIRProfiler()
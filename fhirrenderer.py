@@ -4,35 +4,120 @@
 import io
 import os
 import re
+import json
 import shutil
+import filecmp
+import hashlib
 import textwrap
+import functools
 
-from jinja2 import Environment, PackageLoader, TemplateNotFound
+from jinja2 import Environment, PackageLoader, ModuleLoader, FileSystemBytecodeCache, TemplateNotFound, meta
 from jinja2.filters import environmentfilter
 from logger import logger
+from fhirprofiler import profiler
+import fhirparallel
 
 
 class FHIRRenderer(object):
     """ Superclass for all renderer implementations.
     """
     
-    def __init__(self, spec, settings):
+    environments = {}
+    """ Jinja2 environments shared by all renderers, keyed by template
+    settings, so templates are compiled only once per process. """
+    
+    def __init__(self, spec, settings, manifest=None, dry_run=False):
         self.spec = spec
         self.settings = self.__class__.cleaned_settings(settings)
-        self.jinjaenv = Environment(loader=PackageLoader('generate', self.settings.tpl_base))
-        self.jinjaenv.filters['wordwrap'] = do_wordwrap
+        self.manifest = manifest
+        self.dry_run = dry_run
+        self.source_loader = PackageLoader('generate', self.settings.tpl_base)
+        self.jinjaenv = self.__class__.environment_for(self.settings, dry_run)
+        self._template_sources = {}
     
     @classmethod
     def cleaned_settings(cls, settings):
         """ Splits paths at '/' and re-joins them using os.path.join().
         """
-        settings.tpl_base = os.path.join(*settings.tpl_base.split('/'))
-        settings.tpl_resource_target = os.path.join(*settings.tpl_resource_target.split('/'))
-        settings.tpl_factory_target = os.path.join(*settings.tpl_factory_target.split('/'))
-        settings.tpl_unittest_target = os.path.join(*settings.tpl_unittest_target.split('/'))
-        settings.tpl_resource_target = os.path.join(*settings.tpl_resource_target.split('/'))
+        settings.tpl_base = _native_path(settings.tpl_base)
+        settings.tpl_resource_target = _native_path(settings.tpl_resource_target)
+        settings.tpl_factory_target = _native_path(settings.tpl_factory_target)
+        settings.tpl_unittest_target = _native_path(settings.tpl_unittest_target)
+        settings.tpl_package_target = _native_path(settings.tpl_package_target)
+        if settings.tpl_bytecode_cache:
+            settings.tpl_bytecode_cache = _native_path(settings.tpl_bytecode_cache)
+        if settings.tpl_precompiled_target:
+            settings.tpl_precompiled_target = _native_path(settings.tpl_precompiled_target)
         return settings
     
+    @classmethod
+    def environment_for(cls, settings, dry_run=False):
+        """ Returns the shared Jinja2 environment for the given settings,
+        creating it if needed.
+        
+        Templates are loaded from Python modules in `tpl_precompiled_target`,
+        if set, which are compiled whenever the templates change. Otherwise
+        they are loaded from `tpl_base`, using a bytecode cache in
+        `tpl_bytecode_cache` if that is set. A dry run uses neither, so it
+        writes nothing.
+        """
+        key = (settings.tpl_base, settings.tpl_bytecode_cache, settings.tpl_precompiled_target, dry_run)
+        env = FHIRRenderer.environments.get(key)
+        if env is not None:
+            return env
+        
+        bytecode_cache = None
+        if settings.tpl_bytecode_cache and not dry_run:
+            if not os.path.isdir(settings.tpl_bytecode_cache):
+                os.makedirs(settings.tpl_bytecode_cache)
+            bytecode_cache = FileSystemBytecodeCache(settings.tpl_bytecode_cache)
+        env = Environment(loader=PackageLoader('generate', settings.tpl_base), bytecode_cache=bytecode_cache)
+        env.filters['wordwrap'] = do_wordwrap
+        
+        if settings.tpl_precompiled_target and not dry_run:
+            cls.precompile_templates(env, settings)
+            env = Environment(loader=ModuleLoader(settings.tpl_precompiled_target))
+            env.filters['wordwrap'] = do_wordwrap
+        
+        FHIRRenderer.environments[key] = env
+        return env
+    
+    @classmethod
+    def precompile_templates(cls, env, settings):
+        """ Compiles the templates configured in settings to Python modules in
+        `tpl_precompiled_target`, unless a stamp file shows that the modules
+        there have been compiled from the current template sources.
+        """
+        names = [n for n in [
+            settings.tpl_resource_source,
+            settings.tpl_codesystems_source,
+            settings.tpl_factory_source,
+            settings.tpl_dependencies_source,
+            settings.tpl_unittest_source,
+            settings.tpl_package_source,
+        ] if n]
+        digest = hashlib.sha256()
+        for name in sorted(set(names)):
+            try:
+                source, _, _ = env.loader.get_source(env, name)
+            except TemplateNotFound:
+                continue
+            digest.update(name.encode('utf-8'))
+            digest.update(source.encode('utf-8'))
+        sources_hash = digest.hexdigest()
+        
+        target = settings.tpl_precompiled_target
+        stamp = os.path.join(target, 'templates.sha256')
+        if os.path.exists(stamp):
+            with io.open(stamp, 'r', encoding='utf-8') as handle:
+                if handle.read().strip() == sources_hash:
+                    return
+        
+        logger.info('Precompiling templates to {}'.format(target))
+        env.compile_templates(target, filter_func=lambda n: n in names, zip=None, ignore_errors=False)
+        with io.open(stamp, 'w', encoding='utf-8') as handle:
+            handle.write(sources_hash)
+    
     def render(self):
         """ The main rendering start point, for subclasses to override.
         """
@@ -42,27 +127,185 @@ class FHIRRenderer(object):
         """ Render the given data using a Jinja2 template, writing to the file
         at the target path.
         
+        With a manifest, rendering is skipped if neither the template nor the
+        spec or settings changed since the target was last written, and files
+        are only written if their content actually differs.
+        
         :param template_name: The Jinja2 template to render, located in settings.tpl_base
         :param target_path: Output path
         """
+        self.do_render_all([(data, template_name, target_path)])
+    
+    def do_render_all(self, jobs):
+        """ Renders a list of `(data, template_name, target_path)` tuples like
+        `do_render()`, spreading the Jinja2 renders over `parallel_workers`
+        processes. Files are written by this process, in the given order.
+        
+        A dry run renders nothing, it only logs the targets whose inputs
+        changed, or all targets without a manifest.
+        """
+        pending = []
+        for data, template_name, target_path in jobs:
+            job = self.prepare_render(data, template_name, target_path)
+            if job is not None:
+                pending.append(job)
+        
+        if self.dry_run:
+            for template, data, target_path, input_hash in pending:
+                logger.info('Would render {}'.format(target_path))
+                if self.manifest is not None:
+                    self.manifest.rendered.append(target_path)
+            return
+        
+        rendered = fhirparallel.map_forked(_render_job, pending, self.settings.parallel_workers)
+        for job, content in zip(pending, rendered):
+            self.finish_render(job, content)
+    
+    def prepare_render(self, data, template_name, target_path):
+        """ Looks up the template and consults the manifest.
+        
+        :returns: A `(template, data, target_path, input_hash)` tuple, or None
+            if there is nothing to render
+        """
         try:
             template = self.jinjaenv.get_template(template_name)
         except TemplateNotFound as e:
             logger.error("Template \"{}\" not found in «{}», cannot render"
                 .format(template_name, self.settings.tpl_base))
-            return
+            return None
         
         if not target_path:
             raise Exception("No target filepath provided")
+        
+        input_hash = None
+        if self.manifest is not None:
+            source = self.template_sources(template_name)
+            input_hash = self.manifest.input_hash(template_name, source, target_path)
+            if self.manifest.is_current(target_path, input_hash):
+                logger.debug('Unchanged {}'.format(target_path))
+                return None
+        
+        return (template, data, target_path, input_hash)
+    
+    def template_sources(self, template_name):
+        """ The names and sources of the template and of all templates it
+        includes, imports or extends, directly or not, as one string. If any
+        of them refers to a template by a computed name, all templates are
+        included.
+        """
+        sources = self._template_sources.get(template_name)
+        if sources is not None:
+            return sources
+        
+        names = [template_name]
+        closure = []
+        while len(names) > 0:
+            name = names.pop(0)
+            if name in closure:
+                continue
+            closure.append(name)
+            source, _, _ = self.source_loader.get_source(self.jinjaenv, name)
+            referenced = list(meta.find_referenced_templates(self.jinjaenv.parse(source)))
+            if None in referenced:
+                closure = sorted(self.source_loader.list_templates())
+                break
+            names.extend(referenced)
+        
+        parts = []
+        for name in closure:
+            source, _, _ = self.source_loader.get_source(self.jinjaenv, name)
+            parts.extend([name, source])
+        sources = self._template_sources[template_name] = '\0'.join(parts)
+        return sources
+    
+    def finish_render(self, job, rendered):
+        """ Records and writes rendered content. Writes go to a temporary file
+        that then replaces the target, so targets are never half-written.
+        """
+        template, data, target_path, input_hash = job
+        if self.manifest is not None:
+            self.manifest.did_render(target_path, input_hash, rendered)
+            if _has_content(target_path, rendered):
+                logger.debug('Unchanged {}'.format(target_path))
+                return
+        
         dirpath = os.path.dirname(target_path)
         if not os.path.isdir(dirpath):
             os.makedirs(dirpath)
         
-        with io.open(target_path, 'w', encoding='utf-8') as handle:
+        tmppath = target_path + '.tmp'
+        with io.open(tmppath, 'w', encoding='utf-8') as handle:
             logger.info('Writing {}'.format(target_path))
-            rendered = template.render(data)
             handle.write(rendered)
             # handle.write(rendered.encode('utf-8'))
+        os.replace(tmppath, target_path)
+    
+    def copy_file(self, origpath, target_path):
+        """ Copies a file, skipping the copy if the target already has the
+        same content and a manifest is in use.
+        """
+        if self.manifest is not None and os.path.exists(target_path) and filecmp.cmp(origpath, target_path, shallow=False):
+            logger.debug('Unchanged {}'.format(target_path))
+            return
+        if self.dry_run:
+            logger.info('Would copy {} to {}'.format(os.path.basename(origpath), target_path))
+            return
+        shutil.copyfile(origpath, target_path)
+
+
+class FHIRRenderManifest(object):
+    """ Remembers, per output file, a hash of everything that went into
+    rendering it (spec fingerprint, template and target) as well as a hash of
+    the content that was rendered.
+    """
+    
+    def __init__(self, filepath, fingerprint):
+        self.filepath = filepath
+        self.fingerprint = fingerprint
+        self.entries = {}               # target-path: {"input": hash, "output": hash}
+        self.rendered = []              # target paths rendered (not skipped) in this run, or that would be in a dry run
+        
+        if os.path.exists(filepath):
+            try:
+                with io.open(filepath, 'r', encoding='utf-8') as handle:
+                    self.entries = json.load(handle)
+            except Exception as e:
+                logger.warning('Ignoring unreadable render manifest {}: {}'.format(filepath, e))
+    
+    def input_hash(self, template_name, template_source, target_path):
+        """ Hashes what a target is rendered from; `template_source` should
+        include the templates the template uses, see `template_sources()`.
+        """
+        digest = hashlib.sha256()
+        for part in [self.fingerprint, template_name, template_source, target_path]:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def is_current(self, target_path, input_hash):
+        """ True if the target was rendered from identical input and has not
+        been modified or removed since.
+        """
+        entry = self.entries.get(target_path)
+        if entry is None or entry.get('input') != input_hash:
+            return False
+        if not os.path.exists(target_path):
+            return False
+        with io.open(target_path, 'r', encoding='utf-8') as handle:
+            return entry.get('output') == _content_hash(handle.read())
+    
+    def did_render(self, target_path, input_hash, content):
+        self.entries[target_path] = {
+            'input': input_hash,
+            'output': _content_hash(content),
+        }
+        self.rendered.append(target_path)
+    
+    def write(self):
+        tmppath = self.filepath + '.tmp'
+        with io.open(tmppath, 'w', encoding='utf-8') as handle:
+            json.dump(self.entries, handle, indent=1, sort_keys=True)
+        os.replace(tmppath, self.filepath)
 
 
 class FHIRStructureDefinitionRenderer(FHIRRenderer):
@@ -78,9 +321,10 @@ class FHIRStructureDefinitionRenderer(FHIRRenderer):
             if os.path.exists(filepath):
                 tgt = os.path.join(target_dir, os.path.basename(filepath))
                 logger.info("Copying manual profiles in {} to {}".format(os.path.basename(filepath), tgt))
-                shutil.copyfile(filepath, tgt)
+                self.copy_file(filepath, tgt)
     
     def render(self):
+        jobs = []
         for profile in self.spec.writable_profiles():
             classes = sorted(profile.writable_classes(), key=lambda x: x.name)
             if 0 == len(classes):
@@ -93,7 +337,10 @@ class FHIRStructureDefinitionRenderer(FHIRRenderer):
                 'profile': profile,
                 'info': self.spec.info,
                 'imports': imports,
-                'classes': classes
+                'classes': classes,
+                'slots': self.settings.resource_slots,
+                'from_json': self.settings.resource_from_json,
+                'to_json': self.settings.resource_to_json,
             }
             
             ptrn = profile.targetname.lower() if self.settings.resource_modules_lowercase else profile.targetname
@@ -101,7 +348,8 @@ class FHIRStructureDefinitionRenderer(FHIRRenderer):
             target_name = self.settings.tpl_resource_target_ptrn.format(ptrn)
             target_path = os.path.join(self.settings.tpl_resource_target, target_name)
             
-            self.do_render(data, source_path, target_path)
+            jobs.append((data, source_path, target_path))
+        self.do_render_all(jobs)
         self.copy_files(os.path.dirname(target_path))
 
 
@@ -120,6 +368,30 @@ class FHIRFactoryRenderer(FHIRRenderer):
         self.do_render(data, self.settings.tpl_factory_source, self.settings.tpl_factory_target)
 
 
+class FHIRPackageRenderer(FHIRRenderer):
+    """ Write the `__init__` of the package the classes are generated into,
+    which imports modules and classes when they are first accessed.
+    """
+    def render(self):
+        classes = []
+        for profile in self.spec.writable_profiles():
+            classes.extend(profile.writable_classes())
+        
+        modules = set(klass.module for klass in classes)
+        modules.update(module for path, module, contains in self.settings.manual_profiles if path)
+        if self.settings.write_factory:
+            modules.add(os.path.splitext(os.path.basename(self.settings.tpl_factory_target))[0])
+        if self.settings.tpl_codesystems_source:
+            modules.add(os.path.splitext(self.settings.tpl_codesystems_target_name)[0])
+        
+        data = {
+            'info': self.spec.info,
+            'classes': sorted(classes, key=lambda x: x.name),
+            'modules': sorted(modules),
+        }
+        self.do_render(data, self.settings.tpl_package_source, self.settings.tpl_package_target)
+
+
 class FHIRDependencyRenderer(FHIRRenderer):
     """ Puts down dependencies for each of the FHIR resources. Per resource
     class will grab all class/resource names that are needed for its
@@ -166,6 +438,7 @@ class FHIRUnitTestRenderer(FHIRRenderer):
             return
         
         # render all unit test collections
+        jobs = []
         for coll in self.spec.unit_tests:
             data = {
                 'info': self.spec.info,
@@ -173,13 +446,8 @@ class FHIRUnitTestRenderer(FHIRRenderer):
                 'tests': coll.tests,
             }
             
-            file_pattern = coll.klass.name
-            if self.settings.resource_modules_lowercase:
-                file_pattern = file_pattern.lower()
-            file_name = self.settings.tpl_unittest_target_ptrn.format(file_pattern)
-            file_path = os.path.join(self.settings.tpl_unittest_target, file_name)
-            
-            self.do_render(data, self.settings.tpl_unittest_source, file_path)
+            jobs.append((data, self.settings.tpl_unittest_source, self.target_path(coll.klass)))
+        self.do_render_all(jobs)
         
         # copy unit test files, if any
         if self.settings.unittest_copyfiles is not None:
@@ -188,10 +456,56 @@ class FHIRUnitTestRenderer(FHIRRenderer):
                 if os.path.exists(utfile):
                     target = os.path.join(self.settings.tpl_unittest_target, os.path.basename(utfile))
                     logger.info('Copying unittest file {} to {}'.format(os.path.basename(utfile), target))
-                    shutil.copyfile(utfile, target)
+                    self.copy_file(utfile, target)
                 else:
                     logger.warn("Unit test file \"{}\" configured in `unittest_copyfiles` does not exist"
                         .format(utfile))
+    
+    def target_path(self, klass):
+        """ The unit test file to write for the given FHIRClass. """
+        file_pattern = klass.name
+        if self.settings.resource_modules_lowercase:
+            file_pattern = file_pattern.lower()
+        file_name = self.settings.tpl_unittest_target_ptrn.format(file_pattern)
+        return os.path.join(self.settings.tpl_unittest_target, file_name)
+    
+    def needs_render(self, klass):
+        """ False if the manifest says the unit test file for the given
+        class is current, so its example files need not be parsed.
+        """
+        if self.manifest is None:
+            return True
+        template_name = self.settings.tpl_unittest_source
+        target_path = self.target_path(klass)
+        input_hash = self.manifest.input_hash(template_name, self.template_sources(template_name), target_path)
+        return not self.manifest.is_current(target_path, input_hash)
+
+
+def _native_path(path):
+    """ Re-joins a '/'-separated path with os.path.join(), keeping it
+    absolute if it is.
+    """
+    native = os.path.join(*path.split('/'))
+    return os.sep + native if path.startswith('/') else native
+
+
+def _content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _has_content(filepath, content):
+    """ Whether the file at `filepath` exists and holds exactly `content`.
+    """
+    if not os.path.exists(filepath):
+        return False
+    with io.open(filepath, 'r', encoding='utf-8') as handle:
+        return handle.read() == content
+
+
+def _render_job(job):
+    template, data, target_path, input_hash = job
+    with profiler.timed('render template', template.name), profiler.timed('render file', target_path):
+        return template.render(data)
 
 
 # There is a bug in Jinja's wordwrap (inherited from `textwrap`) in that it
@@ -212,6 +526,12 @@ def do_wordwrap(environment, s, width=79, break_long_words=True, wrapstring=None
     if not wrapstring:
         wrapstring = environment.newline_sequence
     
+    return _wordwrap(s, width, break_long_words, wrapstring)
+
+
+# the same short and formal definitions are wrapped for many classes and properties
+@functools.lru_cache(maxsize=1 << 16)
+def _wordwrap(s, width, break_long_words, wrapstring):
     accumulator = []
     # Workaround: pre-split the string on \r, \r\n and \n
     for component in re.split(r"\r\n|\n|\r", s):
@@ -10,9 +10,14 @@ import json
 import datetime
 
 from logger import logger
+from fhirprofiler import profiler
 import fhirclass
+import fhirbundle
+import fhirparallel
 import fhirunittest
 import fhirrenderer
+import fhirspeccache
+import fhirspecsource
 
 # allow to skip some profiles by matching against their url (used while WiP)
 skip_because_unsupported = [
@@ -29,15 +34,20 @@ class FHIRSpec(object):
         assert settings is not None
         self.directory = directory
         self.settings = settings
+        self.source = fhirspecsource.FHIRSpecSource(directory)
         self.info = FHIRVersionInfo(self, directory)
         self.valuesets = {}             # system-url: FHIRValueSet()
         self.codesystems = {}           # system-url: FHIRCodeSystem()
         self.profiles = {}              # profile-name: FHIRStructureDefinition()
+        self.known_classes = {}         # class-name: FHIRClass()
         self.unit_tests = None          # FHIRUnitTestCollection()
         
-        self.prepare()
-        self.read_profiles()
-        self.finalize()
+        with profiler.phase('prepare'):
+            self.prepare()
+        with profiler.phase('read profiles'):
+            self.read_profiles()
+        with profiler.phase('finalize'):
+            self.finalize()
     
     def prepare(self):
         """ Run actions before starting to parse profiles.
@@ -46,29 +56,25 @@ class FHIRSpec(object):
         self.handle_manual_profiles()
     
     def read_bundle_resources(self, filename):
-        """ Return an array of the Bundle's entry's "resource" elements.
+        """ Generator yielding the Bundle's entry's "resource" elements, one
+        at a time, streamed from disk or straight out of the spec archive.
         """
         logger.info("Reading {}".format(filename))
-        filepath = os.path.join(self.directory, filename)
-        with io.open(filepath, encoding='utf-8') as handle:
-            parsed = json.load(handle)
-            if 'resourceType' not in parsed:
-                raise Exception("Expecting \"resourceType\" to be present, but is not in {}"
-                    .format(filepath))
-            if 'Bundle' != parsed['resourceType']:
-                raise Exception("Can only process \"Bundle\" resources")
-            if 'entry' not in parsed:
-                raise Exception("There are no entries in the Bundle at {}"
-                    .format(filepath))
-            
-            return [e['resource'] for e in parsed['entry']]
+        with self.source.open_text(filename) as handle:
+            reader = fhirbundle.FHIRBundleReader(handle, self.source.path_of(filename))
+            entries = reader.entries()
+            while True:
+                with profiler.timed('read bundle', filename):
+                    entry = next(entries, None)
+                if entry is None:
+                    break
+                yield entry['resource']
     
     
     # MARK: Managing ValueSets and CodeSystems
     
     def read_valuesets(self):
-        resources = self.read_bundle_resources('valuesets.json')
-        for resource in resources:
+        for resource in self.read_bundle_resources('valuesets.json'):
             if 'ValueSet' == resource['resourceType']:
                 assert 'url' in resource
                 self.valuesets[resource['url']] = FHIRValueSet(self, resource)
@@ -93,28 +99,84 @@ class FHIRSpec(object):
     
     def read_profiles(self):
         """ Find all (JSON) profiles and instantiate into FHIRStructureDefinition.
+        
+        With more than one of `parallel_workers`, profiles are parsed here but
+        processed in worker processes, see `process_profiles_parallel()`.
         """
-        resources = []
+        parallel = self.settings.parallel_workers > 1 and fhirparallel.can_fork()
+        pending = []
         for filename in ['profiles-types.json', 'profiles-resources.json']: #, 'profiles-others.json']:
-            bundle_res = self.read_bundle_resources(filename)
-            for resource in bundle_res:
+            for resource in self.read_bundle_resources(filename):
                 if 'StructureDefinition' == resource['resourceType']:
-                    resources.append(resource)
+                    with profiler.timed('parse profile', resource.get('name')):
+                        profile = self.read_profile(resource)
+                        if profile is not None and not parallel:
+                            profile.process_profile()
+                    if profile is not None and parallel:
+                        pending.append(profile)
                 else:
                     logger.debug('Not handling resource of type {}'
                         .format(resource['resourceType']))
         
-        # create profile instances
-        for resource in resources:
-            profile = FHIRStructureDefinition(self, resource)
-            for pattern in skip_because_unsupported:
-                if re.search(pattern, profile.url) is not None:
-                    logger.info('Skipping "{}"'.format(resource['url']))
-                    profile = None
-                    break
-            
-            if profile is not None and self.found_profile(profile):
+        if len(pending) > 0:
+            self.process_profiles_parallel(pending)
+    
+    def read_profile(self, resource):
+        """ Create a profile instance from a StructureDefinition resource.
+        
+        :returns: The FHIRStructureDefinition, unprocessed, or None if it is
+            unsupported or already known
+        """
+        profile = FHIRStructureDefinition(self, resource)
+        for pattern in skip_because_unsupported:
+            if re.search(pattern, profile.url) is not None:
+                logger.info('Skipping "{}"'.format(resource['url']))
+                return None
+        
+        return profile if self.found_profile(profile) else None
+    
+    def process_profiles_parallel(self, profiles):
+        """ Runs `process_profile()` for each profile in a forked worker, each
+        starting from the classes known now, then merges the results in order.
+        
+        A profile whose worker created a class that an earlier profile has
+        already registered is processed again, serially, so that first-wins
+        semantics and output are exactly those of a serial run.
+        """
+        base_classes = dict(self.known_classes)
+        shared = {('spec',): self}
+        for name, klass in base_classes.items():
+            shared[('class', name)] = klass
+        for url, valueset in self.valuesets.items():
+            shared[('valueset', url)] = valueset
+        for url, codesystem in self.codesystems.items():
+            shared[('codesystem', url)] = codesystem
+        
+        def shared_for(profile):
+            job_shared = dict(shared)
+            job_shared[('profile',)] = profile
+            job_shared[('structure',)] = profile.structure
+            return job_shared
+        
+        def process(profile):
+            self.known_classes = dict(base_classes)
+            with profiler.timed('parse profile', profile.name):
                 profile.process_profile()
+            created = [(n, k) for n, k in self.known_classes.items() if n not in base_classes]
+            return fhirparallel.dumps_shared((profile.__dict__, created), shared_for(profile))
+        
+        logger.info('Processing {} profiles using {} workers'.format(len(profiles), self.settings.parallel_workers))
+        results = fhirparallel.map_forked(process, profiles, self.settings.parallel_workers)
+        for profile, data in zip(profiles, results):
+            state, created = fhirparallel.loads_shared(data, shared_for(profile))
+            if any(name in self.known_classes for name, klass in created):
+                logger.debug('Classes of profile "{}" are already known, processing again'.format(profile.name))
+                with profiler.timed('parse profile', profile.name):
+                    profile.process_profile()
+                continue
+            
+            profile.__dict__.update(state)
+            self.known_classes.update(created)
     
     def found_profile(self, profile):
         if not profile or not profile.name:
@@ -126,6 +188,12 @@ class FHIRSpec(object):
         self.profiles[profile.name.lower()] = profile
         return True
     
+    def class_with_name(self, class_name):
+        """ Returns the FHIRClass of the given name known to the receiver, if
+        any.
+        """
+        return self.known_classes.get(class_name)
+    
     def handle_manual_profiles(self):
         """ Creates in-memory representations for all our manually defined
         profiles.
@@ -155,6 +223,15 @@ class FHIRSpec(object):
             prof.finalize()
     
     
+    def __getstate__(self):
+        """ Settings are a module and cannot be pickled; `FHIRSpecCache`
+        assigns them again when loading a snapshot.
+        """
+        state = self.__dict__.copy()
+        state['settings'] = None
+        return state
+    
+    
     # MARK: Naming Utilities
     
     def as_module_name(self, name):
@@ -223,9 +300,18 @@ class FHIRSpec(object):
     
     # MARK: Unit Tests
     
-    def parse_unit_tests(self):
+    def parse_unit_tests(self, renderer=None):
+        """ Parses the example files to create unit tests from. Given a
+        FHIRUnitTestRenderer, skips parsing if it would not render any of the
+        unit test files anyway.
+        """
         controller = fhirunittest.FHIRUnitTestController(self)
-        controller.find_and_parse_tests(self.directory)
+        chosen = controller.find_tests(self.source)
+        if renderer is not None and not any(renderer.needs_render(klass) for klass in set(k for r, k in chosen)):
+            logger.info('Unit tests are unchanged, not parsing example files')
+            self.unit_tests = []
+            return
+        controller.parse_tests_into_collections(chosen)
         self.unit_tests = controller.collections
     
     
@@ -240,26 +326,52 @@ class FHIRSpec(object):
                 profiles.append(profile)
         return profiles
     
-    def write(self):
+    def write(self, dry_run=False):
+        """ Renders all enabled outputs. In a dry run, only logs the files
+        whose inputs changed, without rendering or writing anything.
+        """
+        manifest = None
+        if self.settings.incremental_rendering:
+            manifest = fhirrenderer.FHIRRenderManifest(os.path.join(self.directory, 'render-manifest.json'),
+                self.render_fingerprint())
+        
         if self.settings.write_resources:
-            renderer = fhirrenderer.FHIRStructureDefinitionRenderer(self, self.settings)
-            renderer.render()
-            
-            vsrenderer = fhirrenderer.FHIRValueSetRenderer(self, self.settings)
-            vsrenderer.render()
+            self.render_with(fhirrenderer.FHIRStructureDefinitionRenderer, manifest, dry_run)
+            self.render_with(fhirrenderer.FHIRValueSetRenderer, manifest, dry_run)
         
         if self.settings.write_factory:
-            renderer = fhirrenderer.FHIRFactoryRenderer(self, self.settings)
-            renderer.render()
+            self.render_with(fhirrenderer.FHIRFactoryRenderer, manifest, dry_run)
+        
+        if self.settings.write_package:
+            self.render_with(fhirrenderer.FHIRPackageRenderer, manifest, dry_run)
         
         if self.settings.write_dependencies:
-            renderer = fhirrenderer.FHIRDependencyRenderer(self, self.settings)
-            renderer.render()
+            self.render_with(fhirrenderer.FHIRDependencyRenderer, manifest, dry_run)
         
         if self.settings.write_unittests:
-            self.parse_unit_tests()
-            renderer = fhirrenderer.FHIRUnitTestRenderer(self, self.settings)
+            with profiler.phase('parse unit tests'):
+                self.parse_unit_tests(fhirrenderer.FHIRUnitTestRenderer(self, self.settings, manifest, dry_run))
+            self.render_with(fhirrenderer.FHIRUnitTestRenderer, manifest, dry_run)
+        
+        if manifest is not None:
+            if dry_run:
+                logger.info('Would render {} files whose inputs changed'.format(len(manifest.rendered)))
+            else:
+                logger.info('Rendered {} files whose inputs changed'.format(len(manifest.rendered)))
+                manifest.write()
+    
+    def render_with(self, renderer_class, manifest, dry_run):
+        with profiler.phase(renderer_class.__name__):
+            renderer = renderer_class(self, self.settings, manifest, dry_run)
             renderer.render()
+    
+    def render_fingerprint(self):
+        """ Hash over everything a render depends on besides the template:
+        spec files and examples, settings and the generator's own code.
+        """
+        return fhirspeccache.spec_fingerprint(self.directory, self.settings,
+            fhirspeccache.FHIRSpecCache.inputs + ['examples-json.zip'],
+            fhirspeccache.FHIRSpecCache.sources + ['fhirrenderer.py', 'fhirunittest.py'])
 
 
 class FHIRVersionInfo(object):
@@ -274,12 +386,11 @@ class FHIRVersionInfo(object):
         self.year = now.year
         
         self.version = None
-        infofile = os.path.join(directory, 'version.info')
-        self.read_version(infofile)
+        self.read_version(spec.source, 'version.info')
     
-    def read_version(self, filepath):
-        assert os.path.isfile(filepath)
-        with io.open(filepath, 'r', encoding='utf-8') as handle:
+    def read_version(self, source, filename):
+        assert source.exists(filename)
+        with source.open_text(filename) as handle:
             text = handle.read()
             for line in text.split("\n"):
                 if '=' in line:
@@ -410,6 +521,11 @@ class FHIRStructureDefinition(object):
         self.main_element = None
         self._class_map = {}
         self.classes = []
+        self._elements_by_id = {}
+        self._elements_by_path = {}
+        self._did_resolve_elements = False
+        self._needed_external_classes = None
+        self._referenced_classes = None
         self._did_finalize = False
         
         if profile is not None:
@@ -445,23 +561,25 @@ class FHIRStructureDefinition(object):
         """
         struct = self.structure.differential# or self.structure.snapshot
         if struct is not None:
-            mapped = {}
             self.elements = []
             for elem_dict in struct:
                 element = FHIRStructureDefinitionElement(self, elem_dict, self.main_element is None)
                 self.elements.append(element)
-                mapped[element.path] = element
+                self._elements_by_path[element.path] = element
+                if element.definition.id is not None and element.definition.id not in self._elements_by_id:
+                    self._elements_by_id[element.definition.id] = element
                 
                 # establish hierarchy (may move to extra loop in case elements are no longer in order)
                 if element.is_main_profile_element:
                     self.main_element = element
-                parent = mapped.get(element.parent_name)
+                parent = self._elements_by_path.get(element.parent_name)
                 if parent:
                     parent.add_child(element)
             
             # resolve element dependencies
             for element in self.elements:
                 element.resolve_dependencies()
+            self._did_resolve_elements = True
             
             # run check: if n_min > 0 and parent is in summary, must also be in summary
             for element in self.elements:
@@ -486,11 +604,7 @@ class FHIRStructureDefinition(object):
         """ Returns a FHIRStructureDefinitionElementDefinition with the given
         id, if found. Used to retrieve elements defined via `contentReference`.
         """
-        if self.elements is not None:
-            for element in self.elements:
-                if element.definition.id == ident:
-                    return element
-        return None
+        return self._elements_by_id.get(ident)
     
     
     # MARK: Class Handling
@@ -506,6 +620,8 @@ class FHIRStructureDefinition(object):
         """
         if not self._did_finalize:
             raise Exception('Cannot use `needed_external_classes` before finalizing')
+        if self._needed_external_classes is not None:
+            return self._needed_external_classes
         
         internal = set([c.name for c in self.classes])
         needed = set()
@@ -522,7 +638,7 @@ class FHIRStructureDefinition(object):
             for prop in klass.properties:
                 prop_cls_name = prop.class_name
                 if prop_cls_name not in internal and not self.spec.class_name_is_native(prop_cls_name):
-                    prop_cls = fhirclass.FHIRClass.with_name(prop_cls_name)
+                    prop_cls = self.spec.class_with_name(prop_cls_name)
                     if prop_cls is None:
                         raise Exception('There is no class "{}" for property "{}" on "{}" in {}'.format(prop_cls_name, prop.name, klass.name, self.name))
                     else:
@@ -531,7 +647,8 @@ class FHIRStructureDefinition(object):
                             needed.add(prop_cls_name)
                             needs.append(prop_cls)
         
-        return sorted(needs, key=lambda n: n.module or n.name)
+        self._needed_external_classes = sorted(needs, key=lambda n: n.module or n.name)
+        return self._needed_external_classes
     
     def referenced_classes(self):
         """ Returns a unique list of **external** class names that are
@@ -542,6 +659,8 @@ class FHIRStructureDefinition(object):
         """
         if not self._did_finalize:
             raise Exception('Cannot use `referenced_classes` before finalizing')
+        if self._referenced_classes is not None:
+            return self._referenced_classes
         
         references = set()
         for klass in self.classes:
@@ -553,7 +672,8 @@ class FHIRStructureDefinition(object):
         for klass in self.classes:
             references.discard(klass.name)
         
-        return sorted(references)
+        self._referenced_classes = sorted(references)
+        return self._referenced_classes
     
     def writable_classes(self):
         classes = []
@@ -572,12 +692,13 @@ class FHIRStructureDefinition(object):
         # assign all super-classes as objects
         for cls in self.classes:
             if cls.superclass is None:
-                super_cls = fhirclass.FHIRClass.with_name(cls.superclass_name)
+                super_cls = self.spec.class_with_name(cls.superclass_name)
                 if super_cls is None and cls.superclass_name is not None:
                     raise Exception('There is no class implementation for class named "{}" in profile "{}"'
                         .format(cls.superclass_name, self.url))
                 else:
                     cls.superclass = super_cls
+            cls.finalize()
         
         self._did_finalize = True
 
@@ -803,6 +924,7 @@ class FHIRStructureDefinitionElementDefinition(object):
         self.prop_name = None
         self.content_reference = None
         self._content_referenced = None
+        self._name_if_class = None
         self.short = None
         self.formal = None
         self.comment = None
@@ -875,15 +997,23 @@ class FHIRStructureDefinitionElementDefinition(object):
         """ Determines the class-name that the element would have if it was
         defining a class. This means it uses "name", if present, and the last
         "path" component otherwise.
+        
+        The name is remembered once the profile has resolved all elements,
+        which is when parents and content references can no longer change.
         """
+        if self._name_if_class is not None:
+            return self._name_if_class
         if self._content_referenced is not None:
-            return self._content_referenced.name_if_class()
+            classname = self._content_referenced.name_if_class()
+        else:
+            with_name = self.name or self.prop_name
+            parent_name = self.element.parent.name_if_class() if self.element.parent is not None else None
+            classname = self.element.profile.spec.class_name_for_type(with_name, parent_name)
+            if parent_name is not None and self.element.profile.spec.settings.backbone_class_adds_parent:
+                classname = parent_name + classname
         
-        with_name = self.name or self.prop_name
-        parent_name = self.element.parent.name_if_class() if self.element.parent is not None else None
-        classname = self.element.profile.spec.class_name_for_type(with_name, parent_name)
-        if parent_name is not None and self.element.profile.spec.settings.backbone_class_adds_parent:
-            classname = parent_name + classname
+        if self.element.profile._did_resolve_elements:
+            self._name_if_class = classname
         return classname
 
 
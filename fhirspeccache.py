@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import types
+import pickle
+import hashlib
+
+from logger import logger
+import fhirspecsource
+
+
+class FHIRSpecCache(object):
+    """ On-disk snapshot of a finalized `FHIRSpec`, including its known
+    classes, so unchanged specifications need not be parsed again.
+    
+    Snapshots are keyed by a hash over the downloaded specification files,
+    the settings (which include the mappings) and the generator modules that
+    build the model, so any change to either invalidates them.
+    """
+    
+    format_version = 2
+    
+    inputs = [
+        'version.info',
+        'valuesets.json',
+        'profiles-types.json',
+        'profiles-resources.json',
+    ]
+    
+    sources = [
+        'fhirspec.py',
+        'fhirclass.py',
+        'fhirbundle.py',
+        'fhirspeccache.py',
+        'fhirspecsource.py',
+    ]
+    
+    def __init__(self, directory, settings, filename='fhirspec.cache'):
+        self.directory = directory
+        self.settings = settings
+        self.filepath = os.path.join(directory, filename)
+        self._key = None
+    
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = spec_fingerprint(self.directory, self.settings, self.__class__.inputs, self.__class__.sources)
+        return self._key
+    
+    def load(self):
+        """ Returns the cached FHIRSpec instance, or None if there is no
+        snapshot for the current inputs.
+        """
+        if not os.path.exists(self.filepath):
+            return None
+        try:
+            with io.open(self.filepath, 'rb') as handle:
+                version, key, spec = pickle.load(handle)
+        except Exception as e:
+            logger.warning('Failed to read parsed spec cache {}: {}'.format(self.filepath, e))
+            return None
+        
+        if self.__class__.format_version != version or self.key != key:
+            logger.info('Parsed spec cache is outdated, re-parsing')
+            return None
+        
+        logger.info('Using parsed spec from {}, supply "--reparse" to parse again'.format(self.filepath))
+        spec.settings = self.settings
+        return spec
+    
+    def store(self, spec):
+        """ Writes a snapshot of the given, finalized FHIRSpec.
+        """
+        logger.info('Writing parsed spec cache to {}'.format(self.filepath))
+        tmppath = self.filepath + '.tmp'
+        with io.open(tmppath, 'wb') as handle:
+            pickle.dump((self.__class__.format_version, self.key, spec), handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath, self.filepath)
+
+
+# settings that only change how the generator runs, not what it parses or
+# renders
+_run_only_settings = frozenset([
+    'download_workers', 'download_retries', 'specification_checksums',
+    'expand_spec_archives', 'cache_parsed_spec', 'tpl_bytecode_cache',
+    'tpl_precompiled_target', 'incremental_rendering', 'profile_report_target',
+    'parallel_workers',     # parallel output is the same as serial output
+])
+
+def spec_fingerprint(directory, settings, inputs, sources):
+    """ Hashes the given input files in `directory` (or its archives, see
+    `FHIRSpecSource`), the generator source files in `sources` and all public
+    settings, except those in `_run_only_settings`, into a hex digest.
+    """
+    digest = hashlib.sha256()
+    source = fhirspecsource.FHIRSpecSource(directory)
+    for filename in inputs:
+        digest.update('{}={}\n'.format(filename, source.digest(filename)).encode('utf-8'))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for filename in sources:
+        _update_with_file(digest, filename, os.path.join(here, filename))
+    for name in sorted(vars(settings)):
+        value = getattr(settings, name)
+        if name.startswith('_') or name in _run_only_settings \
+            or isinstance(value, (types.ModuleType, types.FunctionType)):
+            continue
+        digest.update('{}={!r}\n'.format(name, value).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _update_with_file(digest, label, filepath):
+    digest.update(label.encode('utf-8'))
+    if not os.path.exists(filepath):
+        digest.update(b'\0')
+        return
+    with io.open(filepath, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(chunk)
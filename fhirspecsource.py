@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import glob
+import mmap
+import fnmatch
+import hashlib
+import zipfile
+
+
+class FHIRSpecSource(object):
+    """ Gives access to the files of a downloaded specification, whether they
+    have been extracted into the download directory or are still inside one
+    of the archives downloaded there. Extracted files take precedence.
+    
+    Archives are memory-mapped and members are only decompressed when they
+    are opened.
+    """
+    
+    archives = ['examples-json.zip']
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self._zips = None               # [ZipFile()]
+        self._members = None            # member-name: (ZipFile(), ZipInfo())
+    
+    def __getstate__(self):
+        """ Open archives cannot be pickled, they are re-opened on demand.
+        """
+        state = self.__dict__.copy()
+        state['_zips'] = None
+        state['_members'] = None
+        return state
+    
+    def exists(self, name):
+        return os.path.isfile(os.path.join(self.directory, name)) or name in self.members
+    
+    def path_of(self, name):
+        """ A path describing where the file comes from, for messages; for
+        archive members the member name is appended to the archive's path.
+        """
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path) and name in self.members:
+            return os.path.join(self.members[name][0].filename, name)
+        return path
+    
+    def open(self, name):
+        """ Opens the named file for binary reading.
+        """
+        path = os.path.join(self.directory, name)
+        if os.path.isfile(path):
+            return io.open(path, 'rb')
+        if name not in self.members:
+            raise IOError("There is no file \"{}\" in {}".format(name, self.directory))
+        archive, info = self.members[name]
+        return archive.open(info)
+    
+    def open_text(self, name):
+        """ Opens the named file for reading UTF-8 text.
+        """
+        return io.TextIOWrapper(self.open(name), encoding='utf-8')
+    
+    def glob(self, pattern):
+        """ Returns the sorted names of all files whose name matches the given
+        shell-style pattern.
+        """
+        names = set(os.path.basename(p) for p in glob.glob(os.path.join(self.directory, pattern)))
+        names.update(fnmatch.filter(self.members.keys(), pattern))
+        return sorted(names)
+    
+    def digest(self, name):
+        """ A string that changes whenever the named file's content does:
+        a SHA-256 for extracted files, CRC-32 and size for archive members.
+        """
+        path = os.path.join(self.directory, name)
+        if os.path.isfile(path):
+            digest = hashlib.sha256()
+            with io.open(path, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(1 << 20), b''):
+                    digest.update(chunk)
+            return digest.hexdigest()
+        if name in self.members:
+            info = self.members[name][1]
+            return 'zip:{}:{}'.format(info.CRC, info.file_size)
+        return None
+    
+    @property
+    def members(self):
+        if self._members is None:
+            self._zips = []
+            self._members = {}
+            for archive in self.__class__.archives:
+                path = os.path.join(self.directory, archive)
+                if not os.path.isfile(path):
+                    continue
+                z = zipfile.ZipFile(_mapped(path))
+                z.filename = path
+                self._zips.append(z)
+                for info in z.infolist():
+                    if not info.is_dir() and info.filename not in self._members:
+                        self._members[info.filename] = (z, info)
+        return self._members
+
+
+def _mapped(path):
+    """ Memory-maps the file at `path` for reading, falling back to a regular
+    file handle where that is not possible (e.g. for empty files).
+    """
+    with io.open(path, 'rb') as handle:
+        try:
+            return _MappedFile(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            pass
+    return io.open(path, 'rb')
+
+
+class _MappedFile(mmap.mmap):
+    """ `zipfile` wants file objects to tell whether they are seekable, which
+    mmap objects only do since Python 3.13.
+    """
+    def seekable(self):
+        return True
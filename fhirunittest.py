@@ -1,15 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import io
 import re
 import sys
-import glob
 import json
 import os.path
 
 from logger import logger
-import fhirclass
+import fhirparallel
 
 
 class FHIRUnitTestController(object):
@@ -22,15 +20,30 @@ class FHIRUnitTestController(object):
         self.files = None
         self.collections = None
     
-    def find_and_parse_tests(self, directory):
-        self.files = FHIRResourceFile.find_all(directory)
+    def find_and_parse_tests(self, source):
+        self.parse_tests_into_collections(self.find_tests(source))
+    
+    def find_tests(self, source):
+        """ Chooses the example files to test by their resource type only,
+        so no more are parsed than a collection will hold.
         
-        # create tests
-        tests = []
+        :returns: A list of (FHIRResourceFile, FHIRClass) tuples
+        """
+        self.files = FHIRResourceFile.find_all(source)
+        chosen = []
+        counts = {}
         for resource in self.files:
-            test = self.unittest_for_resource(resource)
-            if test is not None:
-                tests.append(test)
+            klass = self.class_for_resource(resource)
+            if klass is not None and counts.get(klass.name, 0) < FHIRUnitTestCollection.max_tests:
+                counts[klass.name] = counts.get(klass.name, 0) + 1
+                chosen.append((resource, klass))
+        return chosen
+    
+    def parse_tests_into_collections(self, chosen):
+        """ Parses the chosen example files into `collections`, one
+        FHIRUnitTestCollection per class.
+        """
+        tests = self.parse_tests(chosen)
         
         # collect per class
         collections = {}
@@ -43,24 +56,46 @@ class FHIRUnitTestController(object):
         
         self.collections = [v for k,v in collections.items()]
     
+    def parse_tests(self, chosen):
+        """ Parses the chosen example files and creates their FHIRUnitTest,
+        in forked worker processes if `parallel_workers` is more than one.
+        
+        :param list chosen: Tuples of (FHIRResourceFile, FHIRClass)
+        :returns: A list of FHIRUnitTest, in the order of `chosen`
+        """
+        workers = self.settings.parallel_workers
+        if workers < 2 or len(chosen) < 2 or not fhirparallel.can_fork():
+            return [FHIRUnitTest(self, resource.filepath, resource.content, klass) for resource, klass in chosen]
+        
+        shared = {('controller',): self, ('spec',): self.spec}
+        for name, klass in self.spec.known_classes.items():
+            shared[('class', name)] = klass
+        
+        def parse(job):
+            resource, klass = job
+            test = FHIRUnitTest(self, resource.filepath, resource.content, klass)
+            return fhirparallel.dumps_shared(test, shared)
+        
+        logger.info('Parsing {} unit tests using {} workers'.format(len(chosen), workers))
+        results = fhirparallel.map_forked(parse, chosen, workers)
+        return [fhirparallel.loads_shared(data, shared) for data in results]
+    
     
     # MARK: Utilities
     
-    def unittest_for_resource(self, resource):
-        """ Returns a FHIRUnitTest instance or None for the given resource,
-        depending on if the class to be tested is known.
+    def class_for_resource(self, resource):
+        """ Returns the FHIRClass to test with the given resource file, or
+        None if there is no such class.
         """
-        classname = resource.content.get('resourceType')
+        classname = resource.resource_type
         assert classname
         if classname in self.settings.classmap:
             classname = self.settings.classmap[classname]
-        klass = fhirclass.FHIRClass.with_name(classname)
+        klass = self.spec.class_with_name(classname)
         if klass is None:
             logger.error('There is no class for "{}", cannot create unit tests'
                 .format(classname))
-            return None
-        
-        return FHIRUnitTest(self, resource.filepath, resource.content, klass)
+        return klass
     
     def make_path(self, prefix, key):
         """ Takes care of combining prefix and key into a path.
@@ -75,14 +110,16 @@ class FHIRUnitTestCollection(object):
     """ Represents a FHIR unit test collection, meaning unit tests pertaining
     to one data model class, to be run against local sample files.
     """
+    max_tests = 10      # let's assume we don't need 100s of unit tests
+    
     def __init__(self, klass):
         self.klass = klass
         self.tests = []
     
     def add_test(self, test):
         if test is not None:
-            if len(self.tests) < 10:
-                self.tests.append(test)      # let's assume we don't need 100s of unit tests
+            if len(self.tests) < self.__class__.max_tests:
+                self.tests.append(test)
 
 
 class FHIRUnitTest(object):
@@ -115,7 +152,7 @@ class FHIRUnitTest(object):
                 logger.warning('Unknown property "{}" in unit test on {} in {}'
                     .format(path, self.klass.name, self.filepath))
             else:
-                propclass = fhirclass.FHIRClass.with_name(prop.class_name)
+                propclass = self.controller.spec.class_with_name(prop.class_name)
                 if propclass is None:
                     path = "{}.{}".format(self.prefix, prop.name) if self.prefix else prop.name
                     logger.error('There is no class "{}" for property "{}" in {}'
@@ -204,22 +241,47 @@ class FHIRUnitTestItem(object):
 class FHIRResourceFile(object):
     """ A FHIR example resource file.
     """
+    
+    # "resourceType" comes first in the spec's examples, so it can usually be
+    # found without parsing the whole file
+    resource_type_pattern = re.compile(r'^\s*\{\s*"resourceType"\s*:\s*"([^"\\]+)"')
+    head_size = 1024
+    
     @classmethod
-    def find_all(cls, directory):
-        """ Finds all example JSON files in the given directory.
+    def find_all(cls, source):
+        """ Finds all example JSON files in the given FHIRSpecSource, be they
+        extracted or still in the examples archive.
         """
-        assert os.path.isdir(directory)
         all_tests = []
-        for utest in glob.glob(os.path.join(directory, '*-example*.json')):
+        for utest in source.glob('*-example*.json'):
             if 'canonical.json' not in utest:
-                all_tests.append(cls(filepath=utest))
+                all_tests.append(cls(source, utest))
         
         return all_tests
     
-    def __init__(self, filepath):
-        self.filepath = filepath
+    def __init__(self, source, filename):
+        self.source = source
+        self.filename = filename
+        self.filepath = source.path_of(filename)
+        self._resource_type = None
         self._content = None
     
+    @property
+    def resource_type(self):
+        """ The resource type of the example, read from the beginning of the
+        file; falls back to parsing the whole file if it is not found there.
+        """
+        if self._resource_type is None:
+            if self._content is None:
+                with self.source.open(self.filename) as handle:
+                    head = handle.read(self.__class__.head_size).decode('utf-8', 'ignore')
+                match = self.__class__.resource_type_pattern.match(head)
+                if match is not None:
+                    self._resource_type = match.group(1)
+            if self._resource_type is None:
+                self._resource_type = self.content.get('resourceType')
+        return self._resource_type
+    
     @property
     def content(self):
         """ Process the unit test file, determining class structure
@@ -228,10 +290,10 @@ class FHIRResourceFile(object):
         :returns: A tuple with (top-class-name, [test-dictionaries])
         """
         if self._content is None:
-            logger.info('Parsing unit test {}'.format(os.path.basename(self.filepath)))
+            logger.info('Parsing unit test {}'.format(self.filename))
             utest = None
-            assert os.path.exists(self.filepath)
-            with io.open(self.filepath, 'r', encoding='utf-8') as handle:
+            assert self.source.exists(self.filename)
+            with self.source.open_text(self.filename) as handle:
                 utest = json.load(handle)
             assert utest
             self._content = utest
@@ -4,14 +4,20 @@
 #  Download and parse FHIR resource definitions
 #  Supply "-f" to force a redownload of the spec
 #  Supply "-c" to force using the cached spec (incompatible with "-f")
-#  Supply "-d" to load and parse but not write resources
+#  Supply "-d" to load and parse but only report which files would change
 #  Supply "-l" to only download the spec
+#  Supply "--reparse" to ignore a cached, previously parsed spec
+#  Supply "-j N" to use N worker processes where work can be parallelized
+#  Supply "--profile" to write a report of time and memory spent per phase
 
 import sys
 
 import settings
+from logger import logger
 import fhirloader
 import fhirspec
+import fhirspeccache
+from fhirprofiler import profiler
 
 _cache = 'downloads'
 
@@ -21,13 +27,33 @@ if '__main__' == __name__:
     dry = len(sys.argv) > 1 and ('-d' in sys.argv or '--dry-run' in sys.argv)
     load_only = len(sys.argv) > 1 and ('-l' in sys.argv or '--load-only' in sys.argv)
     force_cache = len(sys.argv) > 1 and ('-c' in sys.argv or '--cache-only' in sys.argv)
+    force_parse = len(sys.argv) > 1 and '--reparse' in sys.argv
+    if '--profile' in sys.argv:
+        profiler.enable()
+    if '-j' in sys.argv[:-1]:
+        settings.parallel_workers = int(sys.argv[sys.argv.index('-j') + 1])
 
     # assure we have all files
-    loader = fhirloader.FHIRLoader(settings, _cache)
-    spec_source = loader.load(force_download=force_download, force_cache=force_cache)
+    with profiler.phase('load'):
+        loader = fhirloader.FHIRLoader(settings, _cache)
+        spec_source = loader.load(force_download=force_download, force_cache=force_cache)
 
     # parse
     if not load_only:
-        spec = fhirspec.FHIRSpec(spec_source, settings)
-        if not dry:
-            spec.write()
+        spec = None
+        spec_cache = fhirspeccache.FHIRSpecCache(spec_source, settings) if settings.cache_parsed_spec else None
+        if spec_cache is not None and not force_parse:
+            with profiler.phase('load parsed spec'):
+                spec = spec_cache.load()
+        if spec is None:
+            with profiler.phase('parse'):
+                spec = fhirspec.FHIRSpec(spec_source, settings)
+            if spec_cache is not None:
+                with profiler.phase('store parsed spec'):
+                    spec_cache.store(spec)
+        with profiler.phase('write'):
+            spec.write(dry_run=dry)
+    
+    if profiler.enabled:
+        profiler.write(settings.profile_report_target)
+        logger.info('Wrote profile report to {}'.format(settings.profile_report_target))